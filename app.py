@@ -1,23 +1,33 @@
 """This is tic tac toe to play across devices. One player has to create a game (create a client server
 to listen to messages from own device and the other device) and the other one joins the game. Both players
-must know the ip address and the listening port of the client server to connect to it."""
+must know the ip address and the listening port of the client server to connect to it.
 
+Starting it with TTQ_STARTUP_REPORT set prints how long the imports, building the window and its first paint
+took. 'python -X importtime app.py' breaks the imports down further."""
 
 
+
+import time
+STARTED = time.perf_counter() #Taken before the other imports, so that they are part of the startup report
+
 import tkinter as tk
 import tkinter.messagebox as msgbox
 import threading
+import asyncio
 from queue import LifoQueue as Stack #put() and get()
-import time
-from pathlib import Path
 import os
 
 from player_model import PlayerModel
 from player_frame import PlayerFrame
 from player_controller import PlayerController
-from networking import Server, PlayerClient
+from networking import Server, ConnectionPool
+from bot import run_bot
+import metrics
 from screens import InitialScreen, InfoGatheringScreen, IpWindow
 from styles import FOREGROUND_BUTTON, BACKGROUND_BUTTON, BACKGROUND_SCREEN
+import resources
+
+IMPORTED = time.perf_counter()
 
 
 
@@ -28,6 +38,9 @@ class App(tk.Tk):
 
 		super().__init__()
 
+		self.pool = ConnectionPool() #Connections to servers, kept between games
+		self.servers = {} #Servers this app hosts by (ip address, port). They keep running between games
+
 		self.configure_window()
 
 		self.screen_stack = Stack() #Here the window will save a reference and order of the screens that it has packed
@@ -41,9 +54,7 @@ class App(tk.Tk):
 
 		self.title("TicTacStayOverThere")
 		self.configure(bg=BACKGROUND_SCREEN)
-		icon_path = Path(os.getcwd(), "res", "icon.png")
-		icon = tk.PhotoImage(file=icon_path)
-		self.iconphoto(False, icon)
+		self.iconphoto(False, resources.image("icon.png"))
 		self.bind_keys()
 
 
@@ -54,9 +65,9 @@ class App(tk.Tk):
 		self.help_frame = tk.Frame(self, bg=BACKGROUND_SCREEN)
 		self.help_frame.pack(side=tk.BOTTOM)
 
-		#This is a Toplevel window that will give users info on how to connect
-		self.how_to_connect_window = IpWindow(self)
-		self.focus()
+		#This is a Toplevel window that will give users info on how to connect. Few users open it, so it is
+		#only built the first time they do
+		self.how_to_connect_window = None
 
 		my_credits = lambda: msgbox.showinfo("Credits", "Created by Daniel. 2020")
 		self.credits_button = tk.Button(self.help_frame, text="Credits", command=my_credits)
@@ -64,7 +75,7 @@ class App(tk.Tk):
 		self.credits_button.pack(side=tk.RIGHT, pady=(10,10), padx=(5,10))
 
 		self.how_to_connect_button = tk.Button(self.help_frame, text="How to connect")
-		self.how_to_connect_button.configure(bg=BACKGROUND_BUTTON, fg=FOREGROUND_BUTTON, command=lambda: self.how_to_connect_window.deiconify())
+		self.how_to_connect_button.configure(bg=BACKGROUND_BUTTON, fg=FOREGROUND_BUTTON, command=self.show_how_to_connect)
 		self.how_to_connect_button.pack(side=tk.RIGHT, pady=(10,10), padx=(5,0))
 
 		self.back_button = tk.Button(self.help_frame, text="Go back", command=self.go_to_previous_screen)
@@ -72,6 +83,14 @@ class App(tk.Tk):
 		self.back_button.pack(side=tk.LEFT, pady=(10,10), padx=(10,0))
 
 
+	def show_how_to_connect(self):
+
+		if self.how_to_connect_window is None:
+			self.how_to_connect_window = IpWindow(self)
+
+		self.how_to_connect_window.deiconify()
+
+
 	def pack_initial_screen(self):
 
 		self.first_screen = InitialScreen(self)
@@ -98,18 +117,13 @@ class App(tk.Tk):
 			self.current_screen.pack(fill=tk.X)
 
 
-	def go_to_previous_screen(self, send_closing=True):
+	def go_to_previous_screen(self):
 		"""Handles changing screens (from one to the previous)"""
 
 		if not self.screen_stack.empty():
 
-			if type(self.current_screen) == PlayerFrame: #Player is on the game screen a clicks on the back button.
-				if hasattr(self.player_controller, "player_client"):
-					if send_closing:
-						self.player_controller.player_client.send_message("CLOSING")
-					self.player_controller.player_client.client.close()
-				if hasattr(self, "server"):
-					self.server.client.close()
+			if type(self.current_screen) == PlayerFrame: #Player leaves the game, but the connection and server stay up for the next one
+				self.player_controller.close()
 
 			self.current_screen.pack_forget()
 			self.current_screen = self.screen_stack.get()
@@ -124,15 +138,22 @@ class App(tk.Tk):
 
 	def create_game(self, name, ip_address, port, mode):
 		"""Player must create game, that is, a server client is created and it is set to listen for players in a new thread,
-		so that current flow can create player instance and connect to server."""
+		so that current flow can create player instance and connect to server. In 'computer' mode a bot joins as the rival.
+		A server created before on the same address is reused."""
 
-		try:
-			self.server = Server(ip_address, port)
-		except Exception as e:
-			msgbox.showerror("Error creating the server", f"The following error happened when creating the server.\n{e}")
-		else:
-			threading.Thread(target=self.server.accept_players).start()
-			self.join_game(name, ip_address, port, mode)
+		if (ip_address, port) not in self.servers:
+			try:
+				server = Server(ip_address, port)
+			except Exception as e:
+				msgbox.showerror("Error creating the server", f"The following error happened when creating the server.\n{e}")
+				return
+			threading.Thread(target=server.accept_players).start()
+			self.servers[(ip_address, port)] = server
+
+		self.join_game(name, ip_address, port, mode)
+
+		if mode == 'computer': #Bot connects after the player, so they get paired. It stops when the game does.
+			threading.Thread(target=asyncio.run, args=(run_bot(ip_address, port, difficulty="medium"),), daemon=True).start()
 
 
 	def join_game(self, name, ip_address, port, mode):
@@ -141,7 +162,7 @@ class App(tk.Tk):
 		model = PlayerModel(name, ip_address, port, mode)
 		frame = PlayerFrame(self)
 		self.mount_screen(frame)
-		self.player_controller = PlayerController(model, frame)
+		self.player_controller = PlayerController(model, frame, self.pool)
 
 
 	def bind_keys(self):
@@ -154,14 +175,34 @@ class App(tk.Tk):
 		"""App resolves issues before closing the app."""
 
 		if hasattr(self, "player_controller"):
-			self.player_controller.player_client.client.close()
-		if hasattr(self, "server"):
-			self.server.client.close()
+			self.player_controller.close()
+		self.pool.close()
+		for server in self.servers.values():
+			server.close()
 		self.destroy()
 
 
 
+def report_startup(app, built):
+	"""Prints how long startup took, once the window is first drawn. Built is when App() returned."""
+
+	app.update_idletasks()
+	painted = time.perf_counter()
+
+	print(f"Startup: imports {(IMPORTED - STARTED) * 1000:.1f} ms, window {(built - IMPORTED) * 1000:.1f} ms, "
+		f"first paint {(painted - built) * 1000:.1f} ms, total {(painted - STARTED) * 1000:.1f} ms", flush=True)
+
+
+
 if __name__ == "__main__":
 
+	if os.environ.get("TTQ_METRICS_PORT"): #Metrics of the client, and of the server it hosts if any (see metrics.py)
+		metrics.enable_tracing(int(os.environ.get("TTQ_TRACE_SAMPLE", 0)))
+		metrics.start_http_server(int(os.environ["TTQ_METRICS_PORT"]))
+
 	app = App()
+
+	if os.environ.get("TTQ_STARTUP_REPORT"):
+		app.after_idle(report_startup, app, time.perf_counter())
+
 	app.mainloop()
\ No newline at end of file
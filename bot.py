@@ -0,0 +1,293 @@
+"""Computer player. Bot picks moves with a negamax search with alpha-beta pruning, remembering searched
+positions in a bounded transposition table shared by every bot in the process. BotClient connects to a
+server like a PlayerClient does and plays whoever it is paired with. Many bots can share one event loop, and
+each connection can play several games at once, one per channel:
+
+	python bot.py --host 127.0.0.1 --port 50000 --count 100 --difficulty medium
+	python bot.py --host 127.0.0.1 --port 50000 --count 10 --games 50"""
+
+import argparse
+import asyncio
+import random
+from collections import OrderedDict
+
+from engine import Board, IllegalMove, CELLS, ONGOING, X, O, cells
+from protocol import FrameDecoder, ProtocolError, CREATE, PLAYED, CLOSING, PING
+from protocol import encode_hello, encode_played, on_channel, PONG_FRAME
+
+
+
+#Search depth in plies and chance of playing a random move instead, for each difficulty.
+DIFFICULTIES = {
+	"easy": (1, 0.5),
+	"medium": (2, 0.2),
+	"hard": (CELLS, 0.0)
+}
+
+#Deepest search on boards bigger than the classic one, which have far more moves to look at.
+LARGE_BOARD_DEPTH = 2
+
+WIN_SCORE = 1 << 30
+
+#Kinds of transposition table entries
+EXACT = 0
+LOWER = 1 #The real score is at least the stored one
+UPPER = 2 #The real score is at most the stored one
+
+#Cells of the classic board tried first: center, corners, then edges.
+MOVE_ORDER = (4, 0, 2, 6, 8, 1, 3, 5, 7)
+
+
+
+class TranspositionTable():
+
+
+	def __init__(self, size=200000):
+		"""Least recently used cache of searched positions, holding at most size entries."""
+
+		self.size = size
+		self.entries = OrderedDict()
+
+
+	def get(self, key):
+
+		entry = self.entries.get(key)
+
+		if entry is not None:
+			self.entries.move_to_end(key)
+
+		return entry
+
+
+	def put(self, key, entry):
+
+		self.entries[key] = entry
+		self.entries.move_to_end(key)
+
+		if len(self.entries) > self.size:
+			self.entries.popitem(last=False)
+
+
+
+SHARED_TABLE = TranspositionTable()
+
+
+
+class Bot():
+
+
+	def __init__(self, difficulty="hard", table=SHARED_TABLE, rng=None):
+
+		self.depth, self.blunder_rate = DIFFICULTIES[difficulty]
+		self.table = table
+		self.rng = rng if rng is not None else random.Random()
+
+
+	def choose_move(self, board):
+		"""Returns the cell to play on the board for the player to move."""
+
+		if self.rng.random() < self.blunder_rate:
+			return self.rng.choice(list(cells(board.legal)))
+
+		geometry = board.geometry
+		depth = self.depth if geometry.standard else min(self.depth, LARGE_BOARD_DEPTH)
+		me, them = board.masks[board.turn], board.masks[board.turn ^ 1]
+		_, move = self.negamax(geometry, me, them, board.legal, depth, -WIN_SCORE - 1, WIN_SCORE + 1)
+
+		return move
+
+
+	def negamax(self, geometry, me, them, free, depth, alpha, beta):
+		"""Returns (score, best move) for the player owning me, who is to move. Wins score WIN_SCORE minus
+		the plies it takes to get there, so quicker wins are preferred and losses are put off."""
+
+		key = (me, them, geometry)
+		entry = self.table.get(key)
+		hint = None
+
+		if entry is not None:
+			entry_depth, kind, score, hint = entry
+			if entry_depth >= depth and (kind == EXACT or (kind == LOWER and score >= beta) or (kind == UPPER and score <= alpha)):
+				return score, hint
+
+		original_alpha = alpha
+		best_score, best_move = -WIN_SCORE - 1, None
+
+		for index in self.ordered_moves(geometry, me | them, free, hint):
+
+			bit = 1 << index
+			mine = me | bit
+
+			if geometry.is_win(mine, index):
+				score = WIN_SCORE
+			elif free == bit:
+				score = 0
+			elif depth <= 1:
+				score = self.evaluate(geometry, mine, them, index)
+			else:
+				score = -self.negamax(geometry, them, mine, free ^ bit, depth - 1, -beta - 1, -alpha + 1)[0] #Window widened by the adjustment below
+				score -= (score > 0) - (score < 0) #Results farther away count a little less
+
+			if score > best_score:
+				best_score, best_move = score, index
+			if score > alpha:
+				alpha = score
+			if alpha >= beta:
+				break
+
+		kind = UPPER if best_score <= original_alpha else LOWER if best_score >= beta else EXACT
+		self.table.put(key, (depth, kind, best_score, best_move))
+
+		return best_score, best_move
+
+
+	def ordered_moves(self, geometry, taken, free, hint):
+		"""Free cells in the order they should be searched, the move that was best last time first. On bigger
+		boards only the cells next to a token are worth searching, or the center if the board is empty."""
+
+		if hint is not None and free >> hint & 1:
+			yield hint
+
+		if geometry.standard:
+			candidates = MOVE_ORDER
+		elif taken:
+			candidates = cells(geometry.neighbours(taken) & free)
+		else:
+			candidates = (geometry.center(),)
+
+		for index in candidates:
+			if index != hint and free >> index & 1:
+				yield index
+
+
+	def evaluate(self, geometry, mine, them, index):
+		"""Score of the move at index when the search stops before the game ends: the longer the line it
+		makes for the player, and the longer the rival's line it breaks, the better."""
+
+		attack = max(geometry.run_lengths(mine, index))
+		defence = max(geometry.run_lengths(them, index))
+
+		return attack * attack + defence * defence
+
+
+
+class BotClient(asyncio.BufferedProtocol):
+
+
+	def __init__(self, name, bot, done=None, games=1):
+		"""Plays against whoever the server pairs it with, in as many games at once as given, each on a channel
+		of the connection. The connection is closed once every rival has left. Done is a future that is resolved
+		when the connection is lost."""
+
+		self.name = name
+		self.bot = bot
+		self.done = done
+		self.transport = None
+		self.decoder = FrameDecoder()
+		self.games = {channel: None for channel in range(games)} #Channel to the (board, token) of its game
+
+
+	def connection_made(self, transport):
+
+		self.transport = transport
+		self.transport.write(b"".join(on_channel(encode_hello(self.name), channel) for channel in self.games))
+
+
+	def write(self, frame, channel):
+
+		self.transport.write(on_channel(frame, channel) if channel else frame)
+
+
+	def get_buffer(self, sizehint):
+
+		return self.decoder.get_buffer(sizehint)
+
+
+	def buffer_updated(self, nbytes):
+
+		self.decoder.buffer_updated(nbytes)
+
+		try:
+			for message in self.decoder.messages():
+				self.handle_message(message, self.decoder.channel)
+		except ProtocolError as e:
+			print(f"Bot {self.name} got an invalid frame. {e}")
+			self.transport.abort()
+
+
+	def handle_message(self, message, channel=0):
+
+		kind = message[0]
+
+		if kind == PING:
+			self.transport.write(PONG_FRAME)
+			return
+
+		if channel not in self.games: #Game already over
+			return
+
+		if kind == PLAYED:
+			try:
+				self.games[channel][0].play(message[1])
+			except (IllegalMove, TypeError): #Move doesn't fit this game, or there is no game yet
+				return
+			self.move_if_my_turn(channel)
+
+		elif kind == CREATE:
+			self.games[channel] = (Board(message[3], message[4]), X if message[2] == "first" else O)
+			self.move_if_my_turn(channel)
+
+		elif kind == CLOSING:
+			del self.games[channel]
+			if not self.games:
+				self.transport.close()
+
+
+	def move_if_my_turn(self, channel=0):
+
+		board, token = self.games[channel]
+
+		if board.result == ONGOING and board.turn == token:
+			self.write(encode_played(self.bot.choose_move(board)), channel)
+
+
+	def connection_lost(self, exc):
+
+		if self.done is not None and not self.done.done():
+			self.done.set_result(None)
+
+
+
+async def run_bot(ip_address, port, name="Computer", difficulty="hard", games=1):
+	"""Connects a bot to the server and plays the given number of games at once until the connection is
+	closed."""
+
+	loop = asyncio.get_running_loop()
+	done = loop.create_future()
+
+	await loop.create_connection(lambda: BotClient(name, Bot(difficulty), done, games), ip_address, port)
+	await done
+
+
+async def run_bots(ip_address, port, count, difficulty, games=1):
+
+	await asyncio.gather(*(run_bot(ip_address, port, f"Computer {i + 1}", difficulty, games) for i in range(count)))
+
+
+def parse_arguments(args=None):
+
+	parser = argparse.ArgumentParser(description="Connects computer players to a TicTacQuarantine server.")
+	parser.add_argument("--host", default="127.0.0.1", help="Server address (default: 127.0.0.1)")
+	parser.add_argument("--port", type=int, required=True, help="Server port")
+	parser.add_argument("--count", type=int, default=1, help="How many bots to connect (default: 1)")
+	parser.add_argument("--difficulty", choices=DIFFICULTIES, default="hard")
+	parser.add_argument("--games", type=int, default=1, help="Games each bot plays at once over its connection (default: 1)")
+
+	return parser.parse_args(args)
+
+
+
+if __name__ == "__main__":
+
+	options = parse_arguments()
+	asyncio.run(run_bots(options.host, options.port, options.count, options.difficulty, options.games))
\ No newline at end of file
@@ -0,0 +1,103 @@
+"""Keeps track of the lifecycle of every connection the server holds. Peers that go quiet are pinged, and peers
+that don't answer, or never finish the handshake, are dropped so that dead games don't pile up."""
+
+import asyncio
+import time
+
+from protocol import PING_FRAME
+
+
+
+#Connection states
+HANDSHAKING = "handshaking" #Connected, but the player hasn't sent HELLO yet
+QUEUED = "queued" #Player is waiting in the lobby for a rival
+OPEN = "open" #Player is seated in a room
+SPECTATING = "spectating" #Spectator is watching a room
+IDLE = "idle" #Player left its room and may send HELLO again to play someone else
+CLOSING = "closing" #Peer closed its side or is being dropped
+CLOSED = "closed"
+
+
+
+class ConnectionManager():
+
+
+	def __init__(self, heartbeat_interval=10, idle_timeout=30, handshake_timeout=10):
+		"""heartbeat_interval is how many seconds a connection may stay quiet before it is pinged. A connection
+		that stays quiet for idle_timeout seconds, or that doesn't complete the handshake in handshake_timeout
+		seconds, is considered dead and is dropped."""
+
+		self.heartbeat_interval = heartbeat_interval
+		self.idle_timeout = idle_timeout
+		self.handshake_timeout = handshake_timeout
+		self.connections = set()
+		self.reaped = 0
+
+
+	def register(self, connection):
+		"""Starts tracking a connection that was just made."""
+
+		connection.state = HANDSHAKING
+		connection.connected = connection.last_seen = connection.last_ping = time.monotonic()
+		self.connections.add(connection)
+
+
+	def unregister(self, connection):
+		"""Stops tracking a connection that was lost."""
+
+		connection.state = CLOSED
+		self.connections.discard(connection)
+
+
+	async def run(self):
+		"""Checks every connection a few times per heartbeat interval, until cancelled."""
+
+		while True:
+			await asyncio.sleep(min(self.heartbeat_interval, self.handshake_timeout) / 2)
+			self.check()
+
+
+	def check(self, now=None):
+		"""Pings quiet connections and drops the ones that are dead or stuck in the handshake."""
+
+		now = time.monotonic() if now is None else now
+
+		for connection in list(self.connections):
+
+			idle = now - connection.last_seen
+
+			if connection.state == HANDSHAKING and now - connection.connected > self.handshake_timeout: #Trickling bytes doesn't help
+				self.reap(connection, "didn't finish the handshake")
+
+			elif idle > self.idle_timeout:
+				self.reap(connection, f"was idle for {idle:.0f} seconds")
+
+			elif idle > self.heartbeat_interval and now - connection.last_ping > self.heartbeat_interval:
+				connection.last_ping = now
+				connection.send_message(PING_FRAME)
+
+
+	def reap(self, connection, reason):
+		"""Drops a connection without waiting for the peer. Its room is cleaned up when the loss is reported."""
+
+		print(f"Dropped connection {connection.peer}: {reason}")
+		connection.state = CLOSING
+		self.reaped += 1
+		connection.transport.abort()
+
+
+	def report(self):
+		"""Returns one dict per tracked connection with its peer, player name, state, room and idle seconds."""
+
+		now = time.monotonic()
+
+		return [
+			{
+				"peer": connection.peer,
+				"name": connection.name,
+				"state": connection.state,
+				"room": connection.room.room_id if connection.room is not None else None,
+				"idle": round(now - connection.last_seen, 3)
+			}
+			for connection in self.connections
+		]
\ No newline at end of file
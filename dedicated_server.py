@@ -0,0 +1,176 @@
+"""Headless entry point that hosts games without the GUI. Only the networking layer is imported (no tkinter),
+so it starts quickly and runs on machines without a display, such as containers.
+
+Usage: python dedicated_server.py --host 0.0.0.0 --port-range 50000-50010 --max-rooms 5000
+
+With --workers, rooms are spread over that many processes (see supervisor.py). Sending the process SIGUSR1
+prints a summary of its load as JSON. With --metrics-port, counters and latency histograms are served on
+http://127.0.0.1:PORT/metrics in the Prometheus text format (see metrics.py)."""
+
+import argparse
+import asyncio
+import json
+import signal
+
+from networking import Server, POLICIES, DROP
+from supervisor import Supervisor
+from gamelog import GameLogWriter, FSYNC_POLICIES, FSYNC_INTERVAL
+import metrics
+
+
+
+def parse_port_range(text):
+	"""Turns '50000' or '50000-50010' into an inclusive (first, last) tuple."""
+
+	first, _, last = text.partition("-")
+
+	try:
+		first = int(first)
+		last = int(last) if last else first
+	except ValueError:
+		raise argparse.ArgumentTypeError(f"'{text}' is not a port or a port range")
+
+	if not 0 < first <= last < 65536:
+		raise argparse.ArgumentTypeError(f"'{text}' is not a valid port range")
+
+	return first, last
+
+
+def parse_variant(text):
+	"""Turns '15:5' into (15, 5)."""
+
+	size, _, win_length = text.partition(":")
+
+	try:
+		return int(size), int(win_length or size)
+	except ValueError:
+		raise argparse.ArgumentTypeError(f"'{text}' is not a SIZE:WIN board")
+
+
+def parse_arguments(args=None):
+
+	parser = argparse.ArgumentParser(description="Hosts TicTacQuarantine games without a GUI.")
+	parser.add_argument("--host", default="0.0.0.0", help="Address to bind (default: every interface)")
+	parser.add_argument("--port-range", type=parse_port_range, default=(50000, 60000), metavar="FIRST[-LAST]",
+		help="The first free port in this range is used (default: 50000-60000)")
+	parser.add_argument("--max-rooms", type=int, default=None, help="Maximum number of rooms open at once")
+	parser.add_argument("--heartbeat", type=float, default=10, help="Seconds of silence before a player is pinged")
+	parser.add_argument("--idle-timeout", type=float, default=30, help="Seconds of silence before a player is dropped")
+	parser.add_argument("--size", type=int, default=3, help="Board size (default: 3)")
+	parser.add_argument("--win-length", type=int, default=None, help="Cells in a row to win (default: the board size)")
+	parser.add_argument("--allow-variant", type=parse_variant, action="append", default=[], metavar="SIZE:WIN",
+		help="Another board players may ask for, such as 15:5. Can be given more than once")
+	parser.add_argument("--workers", type=int, default=0,
+		help="Worker processes to host rooms in, to use more than one core (default: 0, rooms are hosted in this process)")
+	parser.add_argument("--game-log", default=None, metavar="PATH",
+		help="Append every game to this log. With --workers, each worker writes to PATH.N")
+	parser.add_argument("--fsync", choices=FSYNC_POLICIES, default=FSYNC_INTERVAL,
+		help="When the game log is synced to disk: after every batch, once a second or never (default: interval)")
+	parser.add_argument("--slow-spectators", choices=POLICIES, default=DROP,
+		help="Whether spectators that can't keep up skip moves or are disconnected (default: drop)")
+	parser.add_argument("--resume-timeout", type=float, default=30, metavar="SECONDS",
+		help="Seconds a dropped player's seat is kept for it to reconnect, 0 to end its game right away (default: 30)")
+	parser.add_argument("--max-channels", type=int, default=64, metavar="N",
+		help="Games a connection may play at once on channels other than 0 (default: 64). Not available with --workers")
+	parser.add_argument("--metrics-port", type=int, default=None, metavar="PORT",
+		help="Serve metrics on this local port, at /metrics, and the sampled trace at /trace")
+	parser.add_argument("--trace-sample", type=int, default=0, metavar="N",
+		help="Keep one in every N timings in the trace (default: 0, no trace)")
+
+	return parser.parse_args(args)
+
+
+def create_server(options, game_log=None):
+	"""Creates the server on the first port of the range that can be bound."""
+
+	first, last = options.port_range
+	error = None
+
+	for port in range(first, last + 1):
+		try:
+			if options.workers:
+				return Supervisor(options.host, port, options.workers, options.max_rooms, options.heartbeat, options.idle_timeout,
+					options.size, options.win_length, options.allow_variant, options.game_log, options.fsync, options.slow_spectators,
+					options.resume_timeout)
+			return Server(options.host, port, options.max_rooms, options.heartbeat, options.idle_timeout, options.size, options.win_length,
+				options.allow_variant, game_log, options.slow_spectators, options.resume_timeout, options.max_channels)
+		except OSError as e:
+			error = e
+
+	raise error
+
+
+async def run(server):
+	"""Serves until the process is asked to stop."""
+
+	loop = asyncio.get_running_loop()
+
+	for sig in (signal.SIGINT, signal.SIGTERM):
+		try:
+			loop.add_signal_handler(sig, server.close)
+		except NotImplementedError: #Signal handlers aren't available on Windows event loops
+			pass
+
+	if hasattr(signal, "SIGUSR1"):
+		loop.add_signal_handler(signal.SIGUSR1, lambda: print(json.dumps(server.health()), flush=True))
+
+	await server.serve()
+
+
+def serve_metrics(server, port, trace_sample=0):
+	"""Serves the server's metrics on a local port, along with gauges of its load. Workers don't trace, only
+	the process serving the metrics does."""
+
+	for key, help in (("connections", "Open connections"), ("queued", "Players waiting in the lobby"), ("rooms", "Open rooms")):
+		metrics.gauge(f"ttq_{key}", help, lambda key=key: server.health()[key])
+
+	metrics.enable_tracing(trace_sample)
+
+	return metrics.start_http_server(port, render=server.metrics)
+
+
+def main(args=None):
+
+	options = parse_arguments(args)
+
+	if options.win_length is None:
+		options.win_length = options.size
+
+	game_log = None
+
+	if options.game_log and not options.workers: #Workers open their own logs
+		try:
+			game_log = GameLogWriter(options.game_log, fsync=options.fsync)
+		except (OSError, ValueError) as e:
+			print(f"Couldn't open the game log: {e}")
+			return 1
+
+	try:
+		server = create_server(options, game_log)
+	except OSError as e:
+		print(f"Couldn't bind any port in {options.port_range[0]}-{options.port_range[1]}: {e}")
+		return 1
+	except ValueError as e:
+		print(e)
+		return 1
+	else:
+		print(f"Serving on {server.ip_address}:{server.port}", flush=True)
+		if options.metrics_port is not None:
+			try:
+				serve_metrics(server, options.metrics_port, options.trace_sample)
+			except OSError as e:
+				print(f"Couldn't serve metrics on port {options.metrics_port}: {e}")
+				return 1
+		asyncio.run(run(server))
+		print("Server stopped")
+	finally:
+		if game_log is not None:
+			game_log.close()
+
+	return 0
+
+
+
+if __name__ == "__main__":
+
+	raise SystemExit(main())
\ No newline at end of file
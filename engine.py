@@ -0,0 +1,220 @@
+"""Game rules on bitboards. Each player's position is an integer where bit i is set if the player owns cell i,
+cells being numbered left to right and top to bottom. The free cells are kept as a bitmask too, so a move is
+only a few integer operations. Boards can be any size with any number in a row to win (15x15 with five in a
+row, for instance). Wins are only looked for on the four lines through the last move, so the cost of a move
+doesn't depend on the size of the board. Shared by the player controller, the server and the computer player."""
+
+from functools import lru_cache
+
+
+
+#The classic board
+SIZE = 3
+CELLS = SIZE * SIZE
+FULL = (1 << CELLS) - 1
+
+#Every line that wins the classic game, as a mask of the cells it covers.
+WIN_MASKS = (
+	0b000000111, 0b000111000, 0b111000000, #Rows
+	0b001001001, 0b010010010, 0b100100100, #Columns
+	0b100010001, 0b001010100 #Diagonals
+)
+
+#For each cell of the classic board, only the lines that go through it.
+CELL_WIN_MASKS = tuple(tuple(mask for mask in WIN_MASKS if mask >> index & 1) for index in range(CELLS))
+
+MAX_SIZE = 255 #Board sizes travel in one byte
+
+#Row and column steps of the four lines through a cell: across, down and both diagonals.
+DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))
+
+#Players, used to index Board.masks
+X = 0
+O = 1
+TOKENS = ("X", "O")
+
+#Result of a move
+ONGOING = 0
+WIN = 1
+DRAW = 2
+
+
+
+class IllegalMove(ValueError):
+	"""Raised when a move is made on a taken cell, outside the board or after the game is over."""
+	pass
+
+
+
+def is_win(mask, index):
+	"""Checks if the classic position in mask has a full line through the cell at index."""
+
+	for line in CELL_WIN_MASKS[index]:
+		if mask & line == line:
+			return True
+
+	return False
+
+
+def cells(mask):
+	"""Yields the index of every cell set in mask, lowest first."""
+
+	while mask:
+		low = mask & -mask
+		yield low.bit_length() - 1
+		mask ^= low
+
+
+
+class Geometry():
+
+	__slots__ = ("size", "win_length", "standard", "cells", "full", "rays", "left_column", "right_column")
+
+
+	def __init__(self, size, win_length):
+		"""Everything about a board shape that can be worked out ahead of time. For every cell and each of the
+		four directions it keeps the cells that follow it on both sides, up to win_length - 1 of them, which
+		is all a win through that cell can use. Use geometry() to get one, so every board of a shape shares it."""
+
+		if not 1 < win_length <= size <= MAX_SIZE:
+			raise ValueError(f"Can't play {win_length} in a row on a {size}x{size} board")
+
+		self.size = size
+		self.win_length = win_length
+		self.standard = size == SIZE and win_length == SIZE #Classic game, which has precomputed win masks
+		self.cells = size * size
+		self.full = (1 << self.cells) - 1
+		self.left_column = sum(1 << row * size for row in range(size))
+		self.right_column = self.left_column << size - 1
+		self.rays = tuple(self.cell_rays(index) for index in range(self.cells))
+
+
+	def cell_rays(self, index):
+
+		row, column = divmod(index, self.size)
+		rays = []
+
+		for row_step, column_step in DIRECTIONS:
+			for sign in (1, -1):
+				ray = []
+				r, c = row + sign * row_step, column + sign * column_step
+				while len(ray) < self.win_length - 1 and 0 <= r < self.size and 0 <= c < self.size:
+					ray.append(r * self.size + c)
+					r, c = r + sign * row_step, c + sign * column_step
+				rays.append(tuple(ray))
+
+		return tuple(rays)
+
+
+	def run_lengths(self, mask, index):
+		"""Yields, for each of the four lines through index, how many cells of mask in a row it joins,
+		counting index itself whether it is set or not."""
+
+		rays = self.rays[index]
+
+		for direction in range(0, 8, 2):
+			length = 1
+			for ray in (rays[direction], rays[direction + 1]):
+				for cell in ray:
+					if not mask >> cell & 1:
+						break
+					length += 1
+			yield length
+
+
+	def is_win(self, mask, index):
+		"""Checks if mask has win_length cells in a row through the cell at index."""
+
+		if self.standard:
+			return is_win(mask, index)
+
+		for length in self.run_lengths(mask, index):
+			if length >= self.win_length:
+				return True
+
+		return False
+
+
+	def neighbours(self, mask):
+		"""Cells next to any cell of mask, diagonals included, plus mask itself."""
+
+		across = mask | (mask & ~self.right_column) << 1 | (mask & ~self.left_column) >> 1
+
+		return (across | across << self.size | across >> self.size) & self.full
+
+
+	def center(self):
+
+		return self.cells // 2
+
+
+
+@lru_cache(maxsize=None)
+def geometry(size=SIZE, win_length=SIZE):
+
+	return Geometry(size, win_length)
+
+
+
+class Board():
+
+	__slots__ = ("geometry", "masks", "legal", "turn", "result")
+
+
+	def __init__(self, size=SIZE, win_length=SIZE):
+		"""Empty board with X to move."""
+
+		self.geometry = geometry(size, win_length)
+		self.masks = [0, 0] #Position of X and of O
+		self.legal = self.geometry.full #Free cells
+		self.turn = X
+		self.result = ONGOING
+
+
+	def reset(self):
+
+		self.masks[X] = self.masks[O] = 0
+		self.legal = self.geometry.full
+		self.turn = X
+		self.result = ONGOING
+
+
+	def is_standard(self):
+		"""Checks if this is the classic 3x3 game."""
+
+		return self.geometry.standard
+
+
+	def is_legal(self, index):
+
+		return self.result == ONGOING and 0 <= index < self.geometry.cells and self.legal >> index & 1 == 1
+
+
+	def play(self, index):
+		"""Puts the token of the player to move on the cell at index and returns ONGOING, WIN or DRAW.
+		The turn only passes to the other player while the game is ongoing."""
+
+		if not self.is_legal(index):
+			raise IllegalMove(f"Cell {index} can't be played")
+
+		self.legal ^= 1 << index
+		mask = self.masks[self.turn] = self.masks[self.turn] | 1 << index
+
+		if self.geometry.is_win(mask, index):
+			self.result = WIN
+		elif self.legal == 0:
+			self.result = DRAW
+		else:
+			self.turn ^= 1
+
+		return self.result
+
+
+	def token_at(self, index):
+		"""Returns 'X', 'O' or None."""
+
+		if self.masks[X] >> index & 1:
+			return TOKENS[X]
+		if self.masks[O] >> index & 1:
+			return TOKENS[O]
+		return None
\ No newline at end of file
@@ -0,0 +1,306 @@
+"""Append-only log of every game a server hosts. The file starts with a 16 byte header and is followed by fixed
+16 byte records, little endian:
+
+	bytes 0-3: game id
+	bytes 4-7: time of the event, in seconds since the epoch
+	bytes 8-9: ply, the number of moves played before the event
+	bytes 10-11: cell, whose meaning depends on the kind of record
+	byte 12: kind of record (START, MOVE or END)
+	byte 13: value, whose meaning depends on the kind of record
+	bytes 14-15: reserved
+
+	START: value is the board size and cell the number in a row to win
+	MOVE: value is the player (X or O) and cell the cell played
+	END: value is WIN, DRAW or ABANDONED, and cell the player who won (NO_WINNER if nobody did)
+
+Records of games played at the same time are interleaved. GameLogWriter batches records in memory and appends
+them with one write per batch, syncing them to disk according to its fsync policy. GameLog maps the file into
+memory: a single record or game is read without going through the others, and whole fields are pulled out of
+millions of records at once as arrays, without making a Python object per record."""
+
+import asyncio
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+
+from engine import ONGOING
+
+
+
+MAGIC = b"TTQL\x00\x00\x00\x01" #File signature followed by the format version
+HEADER_SIZE = 16 #Signature and padding, so records are aligned to their size
+RECORD = struct.Struct("<IIHHBBxx") #game, time, ply, cell, kind, value
+
+#Offset and array type of every field, for GameLog.column
+FIELDS = {
+	"game": (0, "I"),
+	"time": (4, "I"),
+	"ply": (8, "H"),
+	"cell": (10, "H"),
+	"kind": (12, "B"),
+	"value": (13, "B"),
+	"event": (12, "H") #kind and value together, kind in the low byte
+}
+
+#Kinds of record
+START = 1
+MOVE = 2
+END = 3
+
+ABANDONED = 3 #Result of a game that ended before anyone won, added to the engine's WIN and DRAW
+NO_WINNER = 0xFFFF
+
+#Fsync policies
+FSYNC_ALWAYS = "always" #Every batch is on disk before flush returns
+FSYNC_INTERVAL = "interval" #The file is synced every fsync_interval seconds
+FSYNC_NEVER = "never" #Left to the operating system
+FSYNC_POLICIES = (FSYNC_ALWAYS, FSYNC_INTERVAL, FSYNC_NEVER)
+
+
+
+class GameLogWriter():
+
+
+	def __init__(self, path, batch_size=4096, flush_interval=0.5, fsync=FSYNC_INTERVAL, fsync_interval=1.0):
+		"""Appends to the log at path, creating it if needed. Records are written once batch_size of them are
+		waiting, or every flush_interval seconds while run() is running, whichever comes first. Records that
+		were cut short by a crash are dropped when the log is opened, and game ids carry on from the last
+		game in the log."""
+
+		if fsync not in FSYNC_POLICIES:
+			raise ValueError(f"Unknown fsync policy '{fsync}'")
+
+		self.path = path
+		self.batch_size = batch_size
+		self.flush_interval = flush_interval
+		self.fsync = fsync
+		self.fsync_interval = fsync_interval
+		self.batch = bytearray()
+		self.pending = 0 #Records in the batch
+		self.unsynced = False
+
+		self.fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+		size = os.fstat(self.fd).st_size
+
+		if size == 0:
+			os.write(self.fd, MAGIC.ljust(HEADER_SIZE, b"\x00"))
+			self.next_game = 1
+		else:
+			if os.pread(self.fd, len(MAGIC), 0) != MAGIC:
+				os.close(self.fd)
+				raise ValueError(f"{path} is not a game log")
+			whole = size - (size - HEADER_SIZE) % RECORD.size
+			if whole != size:
+				os.ftruncate(self.fd, whole)
+			with GameLog(path) as log:
+				self.next_game = max(log.column("game"), default=0) + 1
+
+
+	def start(self, size, win_length):
+		"""Records the start of a game on a size x size board and returns its game id."""
+
+		game = self.next_game
+		self.next_game += 1
+		self.append(game, 0, win_length, START, size)
+
+		return game
+
+
+	def move(self, game, ply, player, index):
+
+		self.append(game, ply, index, MOVE, player)
+
+
+	def end(self, game, ply, result, winner=None):
+		"""Records how the game ended: WIN, DRAW or ABANDONED."""
+
+		self.append(game, ply, NO_WINNER if winner is None else winner, END, result)
+
+
+	def append(self, game, ply, cell, kind, value):
+
+		self.batch += RECORD.pack(game, int(time.time()), ply, cell, kind, value)
+		self.pending += 1
+
+		if self.pending >= self.batch_size:
+			self.flush()
+
+
+	def flush(self):
+		"""Writes the waiting records in one go."""
+
+		if self.batch:
+			os.write(self.fd, self.batch)
+			self.batch.clear()
+			self.pending = 0
+			self.unsynced = True
+
+		if self.fsync == FSYNC_ALWAYS:
+			self.sync()
+
+
+	def sync(self):
+
+		if self.unsynced:
+			os.fsync(self.fd)
+			self.unsynced = False
+
+
+	async def run(self):
+		"""Flushes and syncs the log on time, until cancelled."""
+
+		last_sync = time.monotonic()
+
+		while True:
+			await asyncio.sleep(self.flush_interval)
+			self.flush()
+
+			if self.fsync == FSYNC_INTERVAL and time.monotonic() - last_sync >= self.fsync_interval:
+				last_sync = time.monotonic()
+				self.sync()
+
+
+	def close(self):
+
+		self.flush()
+
+		if self.fsync != FSYNC_NEVER:
+			self.sync()
+
+		os.close(self.fd)
+
+
+
+class GameLog():
+
+
+	def __init__(self, path):
+		"""Read only view of a game log. Records appended after it was opened aren't seen, so open a new one to
+		read them. Can be used in a with statement."""
+
+		with open(path, "rb") as file:
+			self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		if self.map[:len(MAGIC)] != MAGIC:
+			self.map.close()
+			raise ValueError(f"{path} is not a game log")
+
+		self.view = memoryview(self.map)[HEADER_SIZE:HEADER_SIZE + len(self) * RECORD.size]
+		self.columns = {}
+
+
+	def __enter__(self):
+
+		return self
+
+
+	def __exit__(self, *exc):
+
+		self.close()
+
+
+	def __len__(self):
+		"""Number of records."""
+
+		return (len(self.map) - HEADER_SIZE) // RECORD.size
+
+
+	def record(self, i):
+		"""Returns record i as (game, time, ply, cell, kind, value)."""
+
+		return RECORD.unpack_from(self.view, i * RECORD.size)
+
+
+	def records(self):
+		"""Yields every record, in the order they were written."""
+
+		return RECORD.iter_unpack(self.view)
+
+
+	def column(self, field):
+		"""Returns one field of every record as an array, for instance column('game'). The field is copied out
+		of the mapped file with a single strided copy, so this is fast even for millions of records. Arrays
+		are kept for the next call and mustn't be changed."""
+
+		values = self.columns.get(field)
+
+		if values is not None:
+			return values
+
+		offset, typecode = FIELDS[field]
+		values = self.columns[field] = array(typecode)
+		step = RECORD.size // values.itemsize
+
+		if len(self):
+			values.frombytes(self.view.cast(typecode)[offset // values.itemsize::step].tobytes())
+			if sys.byteorder == "big": #Records are little endian
+				values.byteswap()
+
+		return values
+
+
+	def count(self, kind, value=None):
+		"""Number of records of the given kind, and value if given. count(END, WIN) is how many games were won."""
+
+		if value is None:
+			return self.column("kind").count(kind)
+
+		return self.column("event").count(kind | value << 8)
+
+
+	def games(self):
+		"""Ids of every game in the log, in the order they started."""
+
+		games = self.column("game")
+
+		return [games[i] for i in indices(self.column("kind"), START)]
+
+
+	def replay(self, game):
+		"""Returns (size, win_length, moves, result, winner) for the game. Moves are (player, cell) tuples in the
+		order they were played, result is ONGOING if the game has no END record yet and winner is None unless
+		somebody won."""
+
+		games = self.column("game")
+		size = win_length = None
+		moves = []
+		result, winner = ONGOING, None
+
+		for i in indices(games, game):
+			_, _, _, cell, kind, value = self.record(i)
+			if kind == START:
+				size, win_length = value, cell
+			elif kind == MOVE:
+				moves.append((value, cell))
+			elif kind == END:
+				result, winner = value, None if cell == NO_WINNER else cell
+				break
+
+		if size is None:
+			raise KeyError(f"Game {game} isn't in the log")
+
+		return size, win_length, moves, result, winner
+
+
+	def close(self):
+
+		self.columns.clear()
+		self.view.release()
+		self.map.close()
+
+
+
+def indices(values, value):
+	"""Yields every position of value in the array values, searching in C rather than item by item."""
+
+	i = -1
+
+	try:
+		while True:
+			i = values.index(value, i + 1)
+			yield i
+	except ValueError:
+		return
@@ -0,0 +1,384 @@
+"""Hosting rooms on more machines than one. Players connect to a Gateway, which reads their HELLO and pairs them in
+its lobby like a Server does, but doesn't play the games itself: every room is placed on one of the backend Nodes,
+picked by hashing the room id onto a ring of nodes, and the frames of its players are forwarded to that node and
+back. Players can't tell, since they only ever talk to the gateway. Gateways and nodes only talk through a Broker,
+so the same code runs with every piece in one process (LocalBroker, for tests and trying it out) or spread over
+machines with a broker that carries messages over the network:
+
+	python gateway.py --port 50000 --nodes 4"""
+
+import argparse
+import asyncio
+import bisect
+import hashlib
+import itertools
+
+from networking import Server, Room
+from protocol import ProtocolError, PLAYED, RESTART, CLOSING, decode_frame, encode_played, RESTART_FRAME, CLOSING_FRAME
+from connection import OPEN
+from gamelog import GameLogWriter
+from dedicated_server import run
+
+
+
+#Messages from a gateway to a node
+OPEN_ROOM = "open_room" #(OPEN_ROOM, room_id, gateway address, (size, win_length), player names by seat)
+FRAME = "frame" #(FRAME, room_id, seat, frame sent by the player)
+LEFT = "left" #(LEFT, room_id, seat)
+
+#Messages from a node to a gateway
+DELIVER = "deliver" #(DELIVER, room_id, seat, frame for the player)
+
+
+
+class Broker():
+	"""Carries messages between gateways and nodes, which are known by an address. Messages are tuples of
+	strings, integers, bytes and tuples of those, so any broker can serialize them. Messages published from
+	one address to another must arrive in the order they were published."""
+
+
+	def subscribe(self, address, handler):
+		"""Calls handler(message) for every message published to address, on the subscriber's event loop."""
+
+		raise NotImplementedError
+
+
+	def unsubscribe(self, address):
+
+		raise NotImplementedError
+
+
+	def publish(self, address, message):
+
+		raise NotImplementedError
+
+
+
+class LocalBroker(Broker):
+
+
+	def __init__(self):
+		"""Broker for gateways and nodes running on the same event loop. Messages are handed over on the next
+		turn of the loop, never right away, so the timing is close to that of a real broker."""
+
+		self.handlers = {}
+
+
+	def subscribe(self, address, handler):
+
+		self.handlers[address] = handler
+
+
+	def unsubscribe(self, address):
+
+		self.handlers.pop(address, None)
+
+
+	def publish(self, address, message):
+
+		handler = self.handlers.get(address)
+
+		if handler is not None: #Like a network, messages to nobody are lost
+			asyncio.get_running_loop().call_soon(handler, message)
+
+
+
+class HashRing():
+
+
+	def __init__(self, nodes=(), replicas=100):
+		"""Consistent hashing of keys onto nodes. Every node is put on the ring replicas times, so keys spread
+		evenly, and adding or removing a node only moves the keys of that node."""
+
+		self.replicas = replicas
+		self.hashes = []
+		self.nodes = {} #Hash to node
+
+		for node in nodes:
+			self.add(node)
+
+
+	@staticmethod
+	def hash(key):
+
+		return int.from_bytes(hashlib.md5(str(key).encode("utf-8")).digest()[:8], "big") #Spreads far more evenly than crc32
+
+
+	def add(self, node):
+
+		for i in range(self.replicas):
+			h = self.hash(f"{node}#{i}")
+			if h not in self.nodes:
+				self.nodes[h] = node
+				bisect.insort(self.hashes, h)
+
+
+	def remove(self, node):
+
+		for i in range(self.replicas):
+			h = self.hash(f"{node}#{i}")
+			if self.nodes.get(h) == node:
+				del self.nodes[h]
+				self.hashes.remove(h)
+
+
+	def node_for(self, key):
+		"""Returns the node the key belongs to: the first one on the ring at or after the key's hash."""
+
+		if not self.hashes:
+			raise LookupError("There are no nodes on the ring")
+
+		position = bisect.bisect_left(self.hashes, self.hash(key)) % len(self.hashes)
+
+		return self.nodes[self.hashes[position]]
+
+
+
+class RemoteSeat():
+
+	__slots__ = ("node", "gateway", "room_id", "seat", "name", "room", "left", "token")
+
+
+	def __init__(self, node, gateway, room_id, seat, name):
+		"""Stands in for a player in a room hosted on a node, so that Room works unchanged. Frames sent to it
+		go back to the player's gateway."""
+
+		self.node = node
+		self.gateway = gateway
+		self.room_id = room_id
+		self.seat = seat
+		self.name = name
+		self.room = None
+		self.left = False
+		self.token = None #Seats on nodes can't be resumed
+
+
+	def send_message(self, frame):
+
+		self.node.broker.publish(self.gateway, (DELIVER, self.room_id, self.seat, frame))
+
+
+
+class Node():
+
+
+	def __init__(self, address, broker, game_log=None):
+		"""Backend that hosts the rooms the gateways place on it, and plays them like a Server does. The
+		players in them are RemoteSeats. Games are recorded in game_log if a GameLogWriter is given. It is
+		flushed while the node runs, and closing it is left to the caller."""
+
+		self.address = address
+		self.broker = broker
+		self.game_log = game_log
+		self.flusher = None
+		self.rooms = {} #Room id to (room, seats)
+
+
+	def start(self):
+		"""Starts taking messages from the broker. Called on the event loop."""
+
+		self.broker.subscribe(self.address, self.handle_message)
+
+		if self.game_log is not None:
+			self.flusher = asyncio.get_running_loop().create_task(self.game_log.run())
+
+
+	def stop(self):
+
+		self.broker.unsubscribe(self.address)
+
+		if self.flusher is not None:
+			self.flusher.cancel()
+			self.flusher = None
+			self.game_log.flush()
+
+
+	def handle_message(self, message):
+
+		kind, room_id = message[0], message[1]
+
+		if kind == OPEN_ROOM:
+			_, _, gateway, variant, names = message
+			room = Room(room_id, *variant, self.game_log)
+			seats = [RemoteSeat(self, gateway, room_id, seat, name) for seat, name in enumerate(names)]
+			self.rooms[room_id] = (room, seats)
+			for seat in seats:
+				room.add_player(seat)
+			room.setup_game()
+			return
+
+		entry = self.rooms.get(room_id)
+
+		if entry is None: #Room already closed
+			return
+
+		room, seats = entry
+		seat = seats[message[2]]
+
+		if kind == FRAME:
+			try:
+				room.handle_message(seat, decode_frame(message[3]))
+			except (ProtocolError, UnicodeDecodeError) as e: #The gateway only forwards frames it could decode
+				print(f"Node {self.address} got an invalid frame for room {room_id}. {e}")
+
+		elif kind == LEFT and seat.room is room:
+			room.remove_player(seat)
+			if len(room.players) == 0:
+				del self.rooms[room_id]
+
+
+	def health(self):
+
+		return {"node": self.address, "rooms": len(self.rooms)}
+
+
+
+class RoomLink():
+
+	__slots__ = ("room_id", "node", "gateway", "seats", "players")
+
+	spectators = None #Rooms behind a gateway can't be watched
+
+
+	def __init__(self, room_id, node, gateway, players):
+		"""Stands in, on the gateway, for a room hosted on a node. Player messages are turned back into frames
+		and forwarded to the node."""
+
+		self.room_id = room_id
+		self.node = node
+		self.gateway = gateway
+		self.seats = list(players) #Players by seat. A seat is emptied when its player is gone
+		self.players = list(players)
+
+
+	def handle_message(self, player, message):
+
+		kind = message[0]
+
+		if kind == PLAYED:
+			frame = encode_played(message[1])
+		elif kind == RESTART:
+			frame = RESTART_FRAME
+		elif kind == CLOSING:
+			frame = CLOSING_FRAME
+		else:
+			return
+
+		self.gateway.broker.publish(self.node, (FRAME, self.room_id, self.seats.index(player), frame))
+
+
+	def remove_player(self, player):
+
+		seat = self.seats.index(player)
+		self.seats[seat] = None
+		self.players.remove(player)
+		player.room = None
+		self.gateway.broker.publish(self.node, (LEFT, self.room_id, seat))
+
+
+	def deliver(self, seat, frame):
+
+		player = self.seats[seat]
+
+		if player is not None:
+			player.send_message(frame)
+
+
+
+class Gateway(Server):
+
+
+	def __init__(self, ip_address, port, broker, nodes, address="gateway", max_rooms=None, heartbeat_interval=10, idle_timeout=30,
+		size=3, win_length=3, variants=()):
+		"""Server that pairs players and places their rooms on the nodes, known by their broker addresses.
+		Address is the gateway's own, which must be unique when several gateways share the nodes. Rooms stay
+		on the node they were placed on, even if nodes are added or removed later. The other arguments are
+		the same as Server's."""
+
+		super().__init__(ip_address, port, max_rooms, heartbeat_interval, idle_timeout, size, win_length, variants)
+		self.broker = broker
+		self.address = address
+		self.ring = HashRing(nodes)
+		self.room_ids = (f"{address}/{n}" for n in itertools.count(1))
+
+
+	async def serve(self):
+
+		self.broker.subscribe(self.address, self.handle_broker_message)
+
+		try:
+			await super().serve()
+		finally:
+			self.broker.unsubscribe(self.address)
+
+
+	def handle_broker_message(self, message):
+
+		kind, room_id, seat, frame = message
+		link = self.rooms.get(room_id)
+
+		if kind == DELIVER and link is not None:
+			link.deliver(seat, frame)
+
+
+	def watch(self, spectator, room_id):
+		"""Spectators can't watch rooms hosted on nodes yet."""
+
+		print(f"Spectator {spectator.peer} was turned away, rooms behind a gateway can't be watched.")
+		spectator.close()
+
+
+	def open_room(self, variant, players, room_id=None):
+
+		room_id = next(self.room_ids) if room_id is None else room_id
+		node = self.ring.node_for(room_id)
+		link = self.rooms[room_id] = RoomLink(room_id, node, self, players)
+
+		for player in players:
+			player.room = link
+			player.state = OPEN
+
+		self.broker.publish(node, (OPEN_ROOM, room_id, self.address, tuple(variant), tuple(player.name for player in players)))
+
+
+
+async def run_local(options):
+	"""Runs a gateway and its nodes in this process, linked by a LocalBroker."""
+
+	broker = LocalBroker()
+	game_logs = [GameLogWriter(f"{options.game_log}.{i + 1}") if options.game_log else None for i in range(options.nodes)]
+	nodes = [Node(f"node-{i + 1}", broker, game_log) for i, game_log in enumerate(game_logs)]
+
+	for node in nodes:
+		node.start()
+
+	try:
+		gateway = Gateway(options.host, options.port, broker, [node.address for node in nodes], size=options.size,
+			win_length=options.win_length or options.size)
+		print(f"Gateway serving on {gateway.ip_address}:{gateway.port} with {len(nodes)} nodes", flush=True)
+
+		await run(gateway)
+	finally:
+		for node in nodes:
+			node.stop()
+			if node.game_log is not None:
+				node.game_log.close()
+
+
+def parse_arguments(args=None):
+
+	parser = argparse.ArgumentParser(description="Runs a TicTacQuarantine gateway with local nodes.")
+	parser.add_argument("--host", default="0.0.0.0", help="Address to bind (default: every interface)")
+	parser.add_argument("--port", type=int, default=50000, help="Port to bind (default: 50000)")
+	parser.add_argument("--nodes", type=int, default=2, help="How many nodes to host rooms on (default: 2)")
+	parser.add_argument("--size", type=int, default=3, help="Board size (default: 3)")
+	parser.add_argument("--win-length", type=int, default=None, help="Cells in a row to win (default: the board size)")
+	parser.add_argument("--game-log", default=None, metavar="PATH", help="Append every game to a log. Node N writes to PATH.N")
+
+	return parser.parse_args(args)
+
+
+
+if __name__ == "__main__":
+
+	asyncio.run(run_local(parse_arguments()))
@@ -0,0 +1,405 @@
+"""Load test for the server. Spawns a local dedicated server (or targets a running one with --port) and connects
+many synthetic players to it. They speak the real protocol: they open with HELLO, play random moves after CREATE,
+RESTART when a game ends, and say CLOSING once they have played their games. Synthetic spectators can watch the
+first rooms while they play. The report covers connection setup time, move round trip latency, throughput, what
+the spectators received and the server's CPU and memory use, and is also written as JSON so results can be
+compared between releases:
+
+	python loadtest.py --players 2000 --games 5 --output results.json
+	python loadtest.py --players 20 --think 0.1 --spectators 2000"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+
+from engine import Board, ONGOING, X, O, cells
+from protocol import FrameDecoder, ProtocolError, CREATE, PLAYED, REJECTED, PING, WATCHING
+from protocol import encode_hello, encode_played, encode_watch, RESTART_FRAME, CLOSING_FRAME, PONG_FRAME
+
+
+
+class Results():
+
+
+	def __init__(self):
+		"""Measurements gathered from every synthetic player."""
+
+		self.setup_times = [] #Seconds from starting to connect until the first CREATE
+		self.round_trips = [] #Seconds from sending a move until the server relays it back
+		self.games = 0
+		self.moves = 0
+		self.errors = 0
+		self.snapshots = 0 #WATCHING frames received by spectators
+		self.spectated_moves = 0 #PLAYED frames received by spectators
+		self.refused = 0 #Spectators whose room was already closed
+
+
+
+class SyntheticPlayer(asyncio.BufferedProtocol):
+
+
+	def __init__(self, name, games, results, done, think=0):
+		"""Plays the given number of games and then leaves, waiting think seconds before each move. Done is
+		resolved when the connection is lost."""
+
+		self.name = name
+		self.think = think
+		self.games_left = games
+		self.results = results
+		self.done = done
+		self.transport = None
+		self.decoder = FrameDecoder()
+		self.started = time.perf_counter()
+		self.board = None
+		self.token = None
+		self.sent_at = None
+
+
+	def connection_made(self, transport):
+
+		self.transport = transport
+		self.transport.write(encode_hello(self.name))
+
+
+	def get_buffer(self, sizehint):
+
+		return self.decoder.get_buffer(sizehint)
+
+
+	def buffer_updated(self, nbytes):
+
+		self.decoder.buffer_updated(nbytes)
+
+		try:
+			for message in self.decoder.messages():
+				self.handle_message(message)
+		except ProtocolError:
+			self.results.errors += 1
+			self.transport.abort()
+
+
+	def handle_message(self, message):
+
+		kind = message[0]
+
+		if kind == PLAYED:
+			self.received_PLAYED(message[1])
+
+		elif kind == CREATE:
+			if self.board is None:
+				self.results.setup_times.append(time.perf_counter() - self.started)
+			_, _, order, size, win_length = message
+			self.board = Board(size, win_length)
+			self.token = X if order == "first" else O
+			self.move_if_my_turn()
+
+		elif kind == REJECTED: #Synthetic players only make legal moves. Counted as an error when the connection is lost
+			self.transport.abort()
+
+		elif kind == PING:
+			self.transport.write(PONG_FRAME)
+
+
+	def received_PLAYED(self, index):
+
+		if self.board.turn == self.token and self.sent_at is not None: #Own move coming back
+			self.results.round_trips.append(time.perf_counter() - self.sent_at)
+			self.results.moves += 1
+			self.sent_at = None
+
+		self.board.play(index)
+
+		if self.board.result == ONGOING:
+			self.move_if_my_turn()
+			return
+
+		#Game is over. Whoever went first asks for the next game, so that only one RESTART is sent.
+		self.games_left -= 1
+
+		if self.token == X:
+			self.results.games += 1
+
+		if self.games_left <= 0:
+			self.transport.write(CLOSING_FRAME)
+			self.transport.close()
+		elif self.token == X:
+			self.transport.write(RESTART_FRAME)
+
+
+	def move_if_my_turn(self):
+
+		if self.board.turn == self.token:
+			if self.think:
+				asyncio.get_running_loop().call_later(self.think, self.move)
+			else:
+				self.move()
+
+
+	def move(self):
+
+		if not self.transport.is_closing():
+			self.sent_at = time.perf_counter()
+			self.transport.write(encode_played(random.choice(list(cells(self.board.legal)))))
+
+
+	def connection_lost(self, exc):
+
+		if self.games_left > 0:
+			self.results.errors += 1
+
+		if not self.done.done():
+			self.done.set_result(None)
+
+
+
+class SyntheticSpectator(asyncio.BufferedProtocol):
+
+
+	def __init__(self, room_id, results, done):
+		"""Watches a room until it closes, counting what it receives."""
+
+		self.room_id = room_id
+		self.results = results
+		self.done = done
+		self.transport = None
+		self.decoder = FrameDecoder()
+		self.watched = False
+
+
+	def connection_made(self, transport):
+
+		self.transport = transport
+		self.transport.write(encode_watch(self.room_id))
+
+
+	def get_buffer(self, sizehint):
+
+		return self.decoder.get_buffer(sizehint)
+
+
+	def buffer_updated(self, nbytes):
+
+		self.decoder.buffer_updated(nbytes)
+
+		try:
+			for message in self.decoder.messages():
+				kind = message[0]
+				if kind == WATCHING:
+					self.watched = True
+					self.results.snapshots += 1
+				elif kind == PLAYED:
+					self.results.spectated_moves += 1
+				elif kind == PING:
+					self.transport.write(PONG_FRAME)
+		except ProtocolError:
+			self.results.errors += 1
+			self.transport.abort()
+
+
+	def connection_lost(self, exc):
+
+		if not self.watched:
+			self.results.refused += 1
+
+		if not self.done.done():
+			self.done.set_result(None)
+
+
+
+async def connect(host, port, protocol_factory, results):
+	"""Runs a synthetic client until its connection is lost."""
+
+	loop = asyncio.get_running_loop()
+	done = loop.create_future()
+
+	try:
+		await loop.create_connection(lambda: protocol_factory(done), host, port)
+	except OSError:
+		results.errors += 1
+		return
+
+	await done
+
+
+async def run_players(host, port, players, games, ramp, think=0, spectators=0, watch_rooms=1):
+	"""Connects the players, spread evenly over ramp seconds, then the spectators, spread over the first
+	watch_rooms rooms, and waits for all of them to finish."""
+
+	results = Results()
+	tasks = []
+
+	for i in range(players):
+		factory = lambda done, name=f"Load {i}": SyntheticPlayer(name, games, results, done, think)
+		tasks.append(asyncio.create_task(connect(host, port, factory, results)))
+		if ramp:
+			await asyncio.sleep(ramp / players)
+
+	for i in range(spectators):
+		factory = lambda done, room_id=i % watch_rooms + 1: SyntheticSpectator(room_id, results, done)
+		tasks.append(asyncio.create_task(connect(host, port, factory, results)))
+
+	await asyncio.gather(*tasks)
+	return results
+
+
+
+class ServerProcess():
+
+
+	def __init__(self, options):
+		"""Runs dedicated_server.py on a free local port, so its CPU and memory can be measured."""
+
+		probe = socket.socket()
+		probe.bind(("127.0.0.1", 0))
+		self.port = probe.getsockname()[1]
+		probe.close()
+
+		script = os.path.join(os.path.dirname(os.path.abspath(__file__)), "dedicated_server.py")
+		command = [sys.executable, script, "--host", "127.0.0.1", "--port-range", str(self.port),
+			"--size", str(options.size), "--win-length", str(options.win_length or options.size)]
+		self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+		self.wait_until_ready()
+
+
+	def wait_until_ready(self, timeout=10):
+
+		deadline = time.monotonic() + timeout
+
+		while time.monotonic() < deadline:
+			try:
+				socket.create_connection(("127.0.0.1", self.port), timeout=1).close()
+				return
+			except OSError:
+				time.sleep(0.05)
+
+		raise RuntimeError("Server didn't start")
+
+
+	def usage(self):
+		"""Returns (CPU seconds, resident memory in KiB, peak resident memory in KiB), read from /proc."""
+
+		try:
+			with open(f"/proc/{self.process.pid}/stat") as file:
+				fields = file.read().rsplit(")", 1)[1].split()
+			with open(f"/proc/{self.process.pid}/status") as file:
+				status = dict(line.split(":", 1) for line in file)
+		except OSError: #Not on Linux
+			return None, None, None
+
+		cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+		return cpu, int(status["VmRSS"].split()[0]), int(status["VmHWM"].split()[0])
+
+
+	def stop(self):
+
+		self.process.terminate()
+		self.process.wait()
+
+
+
+def percentiles(values):
+	"""Nearest rank percentiles, in milliseconds."""
+
+	if not values:
+		return {}
+
+	values = sorted(values)
+	pick = lambda p: values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000
+
+	return {"p50": pick(50), "p90": pick(90), "p99": pick(99), "max": values[-1] * 1000}
+
+
+def raise_file_limit():
+	"""Every player needs a file descriptor, and on the local server one more."""
+
+	soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+
+	if soft != hard:
+		resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+
+
+def parse_arguments(args=None):
+
+	parser = argparse.ArgumentParser(description="Load tests a TicTacQuarantine server with synthetic players.")
+	parser.add_argument("--players", type=int, default=1000, help="Synthetic players, paired in rooms, so an even number (default: 1000)")
+	parser.add_argument("--games", type=int, default=3, help="Games each player plays (default: 3)")
+	parser.add_argument("--ramp", type=float, default=1.0, help="Seconds over which players connect (default: 1)")
+	parser.add_argument("--think", type=float, default=0, help="Seconds players wait before each move (default: 0)")
+	parser.add_argument("--spectators", type=int, default=0, help="Spectators to connect once the players are in (default: 0)")
+	parser.add_argument("--watch-rooms", type=int, default=1, help="Rooms the spectators are spread over, the first ones opened (default: 1)")
+	parser.add_argument("--host", default="127.0.0.1", help="Server to test when --port is given")
+	parser.add_argument("--port", type=int, default=None, help="Test a running server instead of a local one")
+	parser.add_argument("--size", type=int, default=3, help="Board size of the local server (default: 3)")
+	parser.add_argument("--win-length", type=int, default=None, help="Cells in a row to win on the local server")
+	parser.add_argument("--output", default=None, help="File to write the results to as JSON")
+
+	options = parser.parse_args(args)
+
+	if options.players % 2: #The last player would wait in the lobby forever
+		parser.error("--players must be even, since players are paired")
+
+	return options
+
+
+def main(args=None):
+
+	options = parse_arguments(args)
+	raise_file_limit()
+
+	server = None if options.port else ServerProcess(options)
+	host, port = (options.host, options.port) if server is None else ("127.0.0.1", server.port)
+
+	try:
+		before = server.usage() if server else (None, None, None)
+		started = time.perf_counter()
+		results = asyncio.run(run_players(host, port, options.players, options.games, options.ramp, options.think, options.spectators,
+			options.watch_rooms))
+		duration = time.perf_counter() - started
+		after = server.usage() if server else (None, None, None)
+	finally:
+		if server is not None:
+			server.stop()
+
+	server_cpu = after[0] - before[0] if after[0] is not None else None
+
+	report = {
+		"players": options.players,
+		"games_per_player": options.games,
+		"duration_s": duration,
+		"games": results.games,
+		"moves": results.moves,
+		"errors": results.errors,
+		"moves_per_s": results.moves / duration,
+		"setup_ms": percentiles(results.setup_times),
+		"round_trip_ms": percentiles(results.round_trips),
+		"spectators": options.spectators,
+		"spectator_snapshots": results.snapshots,
+		"spectated_moves": results.spectated_moves,
+		"spectators_refused": results.refused,
+		"server_cpu_s": server_cpu,
+		"server_cpu_percent": 100 * server_cpu / duration if server_cpu is not None else None,
+		"server_rss_kib": after[1],
+		"server_peak_rss_kib": after[2]
+	}
+
+	print(json.dumps(report, indent=4))
+
+	if options.output:
+		with open(options.output, "w") as file:
+			json.dump(report, file, indent=4)
+
+	return 1 if results.errors else 0
+
+
+
+if __name__ == "__main__":
+
+	raise SystemExit(main())
\ No newline at end of file
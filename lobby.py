@@ -0,0 +1,109 @@
+"""Matchmaking. Players waiting for a game are queued by board variant and by rating band, each band being a
+FIFO queue, so pairing a newcomer only looks at a handful of nearby bands no matter how many players wait.
+Players who leave the queue are only marked as gone and skipped when their turn comes, which keeps leaving
+O(1) too. Players that share an owner, such as the channels of one connection, are never paired together."""
+
+from collections import deque
+
+
+
+class Ticket():
+
+	__slots__ = ("player", "owner", "variant", "band", "active")
+
+
+	def __init__(self, player, owner, variant, band):
+
+		self.player = player
+		self.owner = owner
+		self.variant = variant
+		self.band = band
+		self.active = True
+
+
+
+class MatchQueue():
+
+
+	def __init__(self, band_width=100, tolerance=2, owner=None):
+		"""Rated players are paired with someone in their own band of band_width rating points, or up to
+		tolerance bands above or below. Unrated players are paired with anyone playing the same variant.
+		Owner returns what a player belongs to, and players with the same owner are never paired. By default
+		every player is its own owner."""
+
+		self.band_width = band_width
+		self.tolerance = tolerance
+		self.owner = owner or (lambda player: player)
+		self.pools = {} #Variant to {band: deque of tickets}. Unrated players are in band None.
+		self.tickets = {} #Player to its ticket
+
+
+	def __len__(self):
+		"""Number of players waiting."""
+
+		return len(self.tickets)
+
+
+	def enqueue(self, player, variant, rating=None):
+		"""Pairs the player with a waiting rival and returns the rival, or queues the player and returns None.
+		Variant is a (size, win_length) tuple and rating an int, or None for unrated players."""
+
+		pool = self.pools.setdefault(variant, {})
+		owner = self.owner(player)
+
+		if rating is None:
+			band = None
+			bands = [None] + [b for b in pool if b is not None]
+		else:
+			band = rating // self.band_width
+			bands = [band]
+			for distance in range(1, self.tolerance + 1):
+				bands += [band - distance, band + distance]
+			bands.append(None)
+
+		for b in bands:
+			rival = self.pop(pool, b, owner)
+			if rival is not None:
+				return rival
+
+		ticket = Ticket(player, owner, variant, band)
+		pool.setdefault(band, deque()).append(ticket)
+		self.tickets[player] = ticket
+
+		return None
+
+
+	def pop(self, pool, band, owner):
+		"""Takes the player that has waited the longest in the band out of the queue, skipping players that left
+		and leaving those with the given owner where they were."""
+
+		queue = pool.get(band)
+		skipped = []
+		rival = None
+
+		while queue:
+			ticket = queue.popleft()
+			if not ticket.active:
+				continue
+			if ticket.owner is owner:
+				skipped.append(ticket)
+				continue
+			del self.tickets[ticket.player]
+			rival = ticket.player
+			break
+
+		if queue is not None:
+			queue.extendleft(reversed(skipped))
+			if not queue:
+				del pool[band]
+
+		return rival
+
+
+	def cancel(self, player):
+		"""Takes the player out of the queue, if it is waiting."""
+
+		ticket = self.tickets.pop(player, None)
+
+		if ticket is not None:
+			ticket.active = False
\ No newline at end of file
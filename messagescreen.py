@@ -1,32 +1,122 @@
 import tkinter as tk
+from collections import deque
 
 
 
 class MessageScreen(tk.Frame):
 
 
-	def __init__(self, *args, **kwargs):
-		"""This is a Text widget that will inform the user of everything that happens in the game."""
+	def __init__(self, *args, capacity=500, history=None, **kwargs):
+		"""This is a Text widget that will inform the user of everything that happens in the game, newest message
+		first. Only the last capacity messages are kept, in a ring buffer, and the Text widget only holds the few
+		that fit in it, so long sessions cost no more memory or redrawing than short ones. Messages written in
+		the same turn of the Tk loop are drawn together. If history is a path, every message is also appended
+		to that file."""
 
 		super().__init__(*args, **kwargs)
 
+		self.messages = deque(maxlen=capacity)
+		self.pending = [] #Messages written since the last redraw
+		self.history = history
+		self.offset = 0 #Messages scrolled past, from the newest
+		self.flush_id = None
+
 		self.text_area = tk.Text(self, bg="white", fg="black")
 		self.text_area.configure(height=12, width=40, state="disabled")
+		self.visible = int(self.text_area.cget("height")) // 2 #Every message takes a blank line and its own
 		self.scroll_bar = tk.Scrollbar(self, orient="vertical", command=self.scroll_text)
-		self.text_area.configure(yscrollcommand=self.scroll_bar.set)
+		self.scroll_bar.set(0, 1)
+
+		for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+			self.text_area.bind(sequence, self.on_wheel)
 
 		self.scroll_bar.pack(side=tk.RIGHT, fill=tk.Y)
 		self.text_area.pack(side=tk.RIGHT)
 
 
 	def scroll_text(self, *args):
-		"""Handles scrollbar behavior."""
+		"""Handles scrollbar behavior: ('moveto', fraction) or ('scroll', amount, 'units' or 'pages')."""
+
+		if args[0] == "moveto":
+			offset = round(float(args[1]) * len(self.messages))
+		else:
+			offset = self.offset + int(args[1]) * (self.visible if args[2] == "pages" else 1)
+
+		self.scroll_to(offset)
+
+
+	def on_wheel(self, event):
+
+		up = event.num == 4 or getattr(event, "delta", 0) > 0
+		self.scroll_to(self.offset + (-1 if up else 1))
+
+		return "break" #The Text widget only holds what is shown, so it mustn't scroll on its own
 
-		self.text_area.yview_moveto(args[1])
+
+	def scroll_to(self, offset):
+
+		offset = max(0, min(offset, len(self.messages) - self.visible))
+
+		if offset != self.offset:
+			self.offset = offset
+			self.render()
 
 
 	def write(self, message):
 
+		self.pending.append(message)
+
+		if self.flush_id is None:
+			self.flush_id = self.after_idle(self.flush)
+
+
+	def flush(self):
+		"""Adds the pending messages and redraws once."""
+
+		self.flush_id = None
+		pending, self.pending = self.pending, []
+
+		if self.history is not None:
+			with open(self.history, "a", encoding="utf-8") as file:
+				file.writelines(f"{message}\n" for message in pending)
+
+		self.messages.extend(pending)
+
+		if self.offset: #Keeps what the user scrolled to in view
+			self.offset = min(self.offset + len(pending), max(0, len(self.messages) - self.visible))
+
+		self.render()
+
+
+	def render(self):
+		"""Puts the messages that fit in the widget, from offset on, and updates the scrollbar."""
+
+		count = len(self.messages)
+		newest = count - 1 - self.offset
+		shown = [self.messages[i] for i in range(newest, max(-1, newest - self.visible), -1)]
+
 		self.text_area.configure(state="normal")
-		self.text_area.insert(1.0, f"\n    {message}\n")
-		self.text_area.configure(state="disabled")
\ No newline at end of file
+		self.text_area.delete(1.0, tk.END)
+		self.text_area.insert(1.0, "".join(f"\n    {message}\n" for message in shown))
+		self.text_area.configure(state="disabled")
+
+		if count > self.visible:
+			self.scroll_bar.set(self.offset / count, (self.offset + len(shown)) / count)
+		else:
+			self.scroll_bar.set(0, 1)
+
+
+	def export(self, path):
+		"""Writes the messages that are kept, oldest first, to a file."""
+
+		with open(path, "w", encoding="utf-8") as file:
+			file.writelines(f"{message}\n" for message in self.messages)
+
+
+	def destroy(self):
+
+		if self.flush_id is not None:
+			self.after_cancel(self.flush_id)
+			self.flush_id = None
+
+		super().destroy()
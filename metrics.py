@@ -0,0 +1,277 @@
+"""Counters and latency histograms for the hot paths of the server and the client, cheap enough to leave on: a
+counter is an integer addition and a histogram a bisect over a dozen buckets. They are read through a small HTTP
+endpoint in the Prometheus text format:
+
+	curl http://127.0.0.1:9100/metrics
+
+Timings can also be sampled into a trace, one in every N, which the endpoint serves at /trace in the Chrome trace
+event format (open it in chrome://tracing or Perfetto). Tracing is off unless a sample rate is set."""
+
+import bisect
+import json
+import os
+import threading
+import time
+from collections import deque
+
+
+
+#Upper bounds, in seconds, of the buckets of latency histograms
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+
+
+class Counter():
+
+
+	def __init__(self, name, help, label=None):
+		"""Count that only goes up. If label is given, a count is kept for every value of the label, for
+		instance one per message type."""
+
+		self.name = name
+		self.help = help
+		self.label = label
+		self.values = {}
+
+
+	def inc(self, label_value=None, amount=1):
+
+		self.values[label_value] = self.values.get(label_value, 0) + amount
+
+
+	def snapshot(self):
+
+		return {str(key) if key is not None else "": value for key, value in self.values.items()}
+
+
+	def lines(self, snapshots):
+
+		totals = dict(self.snapshot())
+
+		for snapshot in snapshots:
+			for key, value in snapshot.items():
+				totals[key] = totals.get(key, 0) + value
+
+		yield f"# HELP {self.name} {self.help}"
+		yield f"# TYPE {self.name} counter"
+
+		if self.label is None:
+			yield f"{self.name} {totals.get('', 0)}"
+		else:
+			for key, value in sorted(totals.items()):
+				yield f'{self.name}{{{self.label}="{key}"}} {value}'
+
+
+
+class Gauge():
+
+
+	def __init__(self, name, help, function):
+		"""Value read when the metrics are rendered, by calling function."""
+
+		self.name = name
+		self.help = help
+		self.function = function
+
+
+	def lines(self, snapshots):
+
+		yield f"# HELP {self.name} {self.help}"
+		yield f"# TYPE {self.name} gauge"
+		yield f"{self.name} {self.function() + sum(snapshots)}"
+
+
+
+class Histogram():
+
+
+	def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+		"""Distribution of observed values, such as latencies in seconds, counted in buckets with the given
+		upper bounds."""
+
+		self.name = name
+		self.help = help
+		self.buckets = tuple(buckets)
+		self.counts = [0] * (len(self.buckets) + 1) #Last one is above every bound
+		self.sum = 0.0
+
+
+	def observe(self, value):
+
+		self.counts[bisect.bisect_left(self.buckets, value)] += 1
+		self.sum += value
+
+
+	def time(self, started):
+		"""Observes the seconds since started, a time.perf_counter() value, and samples it into the trace."""
+
+		now = time.perf_counter()
+		self.observe(now - started)
+
+		if TRACER.sample:
+			TRACER.record(self.name, started, now)
+
+
+	def snapshot(self):
+
+		return list(self.counts) + [self.sum]
+
+
+	def lines(self, snapshots):
+
+		counts = list(self.counts)
+		total = self.sum
+
+		for snapshot in snapshots:
+			for i, count in enumerate(snapshot[:-1]):
+				counts[i] += count
+			total += snapshot[-1]
+
+		yield f"# HELP {self.name} {self.help}"
+		yield f"# TYPE {self.name} histogram"
+
+		cumulative = 0
+		for bound, count in zip(self.buckets + ("+Inf",), counts):
+			cumulative += count
+			yield f'{self.name}_bucket{{le="{bound}"}} {cumulative}'
+
+		yield f"{self.name}_sum {total}"
+		yield f"{self.name}_count {cumulative}"
+
+
+
+class Registry():
+
+
+	def __init__(self):
+		"""Every metric of the process, by name."""
+
+		self.metrics = {}
+
+
+	def add(self, metric):
+
+		if metric.name in self.metrics:
+			raise ValueError(f"Metric {metric.name} already exists")
+
+		self.metrics[metric.name] = metric
+
+		return metric
+
+
+	def snapshot(self):
+		"""Returns the values of every counter and histogram as plain lists and dicts, so they can be sent to
+		another process and added to its own with render."""
+
+		return {name: metric.snapshot() for name, metric in list(self.metrics.items()) if not isinstance(metric, Gauge)}
+
+
+	def render(self, snapshots=()):
+		"""Returns every metric in the Prometheus text format, adding up the given snapshots of other processes."""
+
+		snapshots = list(snapshots)
+		lines = []
+
+		for name, metric in list(self.metrics.items()):
+			lines.extend(metric.lines([snapshot[name] for snapshot in snapshots if name in snapshot]))
+
+		return "\n".join(lines) + "\n"
+
+
+
+class Tracer():
+
+
+	def __init__(self, sample=0, size=10000):
+		"""Keeps one in every sample timings, the last size of them. A sample of 0 keeps none."""
+
+		self.sample = sample
+		self.calls = 0
+		self.spans = deque(maxlen=size)
+
+
+	def record(self, name, started, ended):
+
+		self.calls += 1
+
+		if self.calls % self.sample == 0:
+			self.spans.append((name, started, ended, threading.get_ident()))
+
+
+	def dump(self):
+		"""Returns the sampled timings in the Chrome trace event format."""
+
+		pid = os.getpid()
+		events = [
+			{"name": name, "ph": "X", "ts": started * 1e6, "dur": (ended - started) * 1e6, "pid": pid, "tid": tid}
+			for name, started, ended, tid in list(self.spans)
+		]
+
+		return json.dumps({"traceEvents": events})
+
+
+
+REGISTRY = Registry()
+TRACER = Tracer()
+
+
+def counter(name, help, label=None):
+
+	return REGISTRY.add(Counter(name, help, label))
+
+
+def gauge(name, help, function):
+
+	return REGISTRY.add(Gauge(name, help, function))
+
+
+def histogram(name, help, buckets=LATENCY_BUCKETS):
+
+	return REGISTRY.add(Histogram(name, help, buckets))
+
+
+def enable_tracing(sample):
+	"""Starts sampling one in every sample timings into the trace."""
+
+	TRACER.sample = sample
+
+
+
+def start_http_server(port, host="127.0.0.1", render=None):
+	"""Serves the metrics on a thread of their own, so scrapes never wait on the event loop nor the Tk loop.
+	Render returns the text to serve, REGISTRY.render by default. Returns the HTTP server, which is stopped
+	with shutdown()."""
+
+	#Imported here since it takes longer to import than the rest of the app's networking, and most processes
+	#never serve metrics
+	from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+	class MetricsHandler(BaseHTTPRequestHandler):
+
+		def do_GET(self):
+
+			if self.path.split("?")[0] in ("/", "/metrics"):
+				body, content_type = self.server.render(), "text/plain; version=0.0.4; charset=utf-8"
+			elif self.path.split("?")[0] == "/trace":
+				body, content_type = TRACER.dump(), "application/json"
+			else:
+				self.send_error(404)
+				return
+
+			body = body.encode("utf-8")
+			self.send_response(200)
+			self.send_header("Content-Type", content_type)
+			self.send_header("Content-Length", str(len(body)))
+			self.end_headers()
+			self.wfile.write(body)
+
+		def log_message(self, format, *args): #Scrapes aren't worth a line each
+
+			pass
+
+	http_server = ThreadingHTTPServer((host, port), MetricsHandler)
+	http_server.daemon_threads = True
+	http_server.render = render or REGISTRY.render
+	threading.Thread(target=http_server.serve_forever, daemon=True).start()
+
+	return http_server
@@ -1,143 +1,1185 @@
 import socket
-import time
 import threading
+import asyncio
+import time
+import itertools
 import random
+import os
+import struct
+from collections import deque
+
+from protocol import FrameDecoder, ProtocolError, HELLO, PLAYED, RESTART, CLOSING, PING, PONG, WATCH, LEAVE, SESSION, RESUME, RESUMED
+from protocol import CAP_VARIANTS, CAP_RESUME, ORDERS, CREATE
+from protocol import encode_create, encode_played, encode_rejected, encode_watching, encode_session, encode_resume, encode_resumed
+from protocol import CLOSING_FRAME, PONG_FRAME, LEAVE_FRAME, NAMES, MAX_CHANNEL, on_channel
+from engine import Board, ONGOING, WIN, X, O, geometry, cells
+from gamelog import ABANDONED
+from connection import ConnectionManager, HANDSHAKING, QUEUED, OPEN, SPECTATING, IDLE, CLOSED, CLOSING as CLOSING_STATE
+from lobby import MatchQueue
+import metrics
+
+
+
+#What is done with a peer that doesn't read as fast as frames are sent to it, once more than the high watermark
+#of bytes is waiting to be sent
+DROP = "drop" #Frames are skipped until the backlog is down to the low watermark
+DISCONNECT = "disconnect" #Connection is dropped
+POLICIES = (DROP, DISCONNECT)
+
+#(low, high) watermarks in bytes. Players can't miss a frame, so when they fall behind they are disconnected.
+PLAYER_WATERMARKS = (16 * 1024, 64 * 1024)
+SPECTATOR_WATERMARKS = (4 * 1024, 16 * 1024)
+
+ACCEPTS = metrics.counter("ttq_accepts_total", "Connections accepted")
+HANDSHAKES = metrics.counter("ttq_handshakes_total", "Players that completed the handshake")
+HANDSHAKE_TIME = metrics.histogram("ttq_handshake_seconds", "Time from accepting a connection to its HELLO")
+MESSAGES = metrics.counter("ttq_messages_total", "Messages received from peers", "type")
+MESSAGE_TIME = metrics.histogram("ttq_message_seconds", "Time the server took to handle a message")
+SESSIONS = metrics.counter("ttq_sessions_total", "Seats of dropped players, by what became of them", "outcome")
+
+TOKEN_ROOM = struct.Struct("!I") #Session tokens start with the room id, so a supervisor knows which worker has the seat
+
+
+
+def session_token(room_id):
+	"""New token for a seat in the room with the given id: the id followed by 12 random bytes."""
+
+	return TOKEN_ROOM.pack(room_id) + os.urandom(12)
+
+
+def session_room(token):
+	"""Id of the room a token was issued for, or None if it isn't a token."""
+
+	return TOKEN_ROOM.unpack_from(token)[0] if len(token) == TOKEN_ROOM.size + 12 else None
+
+
+def owner(player):
+	"""Connection the player plays over, which is the player itself unless it is a PlayerChannel."""
+
+	return getattr(player, "connection", player)
+
+
+
+class Room(Board):
+
+	__slots__ = ("room_id", "players", "log", "game", "spectators", "games", "moves")
+
+
+	def __init__(self, room_id, size=3, win_length=3, log=None):
+		"""A room seats two players and relays their messages, the same way the old one-game Server did.
+		Many rooms live on the same Server, so every match can be hosted on one port. Games in the room
+		are played on a size x size board with win_length in a row to win.
+		The room is itself the board of the game being played, so the server knows whose turn it is and
+		which cells are free, and moves that break the rules never reach the rival. Once seated, players[X]
+		plays X and players[O] plays O. Rooms have no __dict__, which keeps each one under 400 bytes.
+		If a GameLogWriter is given as log, every game played in the room is recorded in it. Spectators
+		get every move too. The moves of the current game are kept, so a player that reconnects can be told
+		the ones it missed."""
+
+		super().__init__(size, win_length)
+		self.room_id = room_id
+		self.players = []
+		self.log = log
+		self.game = None #Id in the log of the game being played
+		self.spectators = None #Set of spectators, once someone watches
+		self.games = 0 #Games set up in the room so far, the current one included
+		self.moves = [] #Cells played in the current game, in order
+
+
+	def is_full(self):
+		"""Returns True once both seats are taken."""
+
+		return len(self.players) == 2
+
+
+	def add_player(self, player):
+		"""Seats the player in this room."""
+
+		self.players.append(player)
+		player.room = self
+
+
+	def other(self, player):
+		"""Returns the rival of the given player, or None if the player is alone in the room."""
+
+		for p in self.players:
+			if p is not player:
+				return p
+
+		return None
+
+
+	def setup_game(self):
+		"""Decides which player will begin, clears the board and sends each player the
+		'CREATE rival_name order size win_length' message"""
+
+		random.shuffle(self.players) #Whoever ends up first plays X
+		self.log_abandoned()
+		self.reset()
+		self.games += 1
+		self.moves.clear()
+
+		first, second = self.players
+		size, win_length = self.geometry.size, self.geometry.win_length
+
+		if self.log is not None:
+			self.game = self.log.start(size, win_length)
+
+		first.send_message(encode_create(second.name, "first", size, win_length))
+		second.send_message(encode_create(first.name, "second", size, win_length))
+
+		for player in self.players:
+			if player.token is not None:
+				player.send_message(encode_session(player.token, self.games))
+
+		if self.spectators:
+			self.broadcast(self.snapshot())
+
+
+	def handle_message(self, player, message):
+		"""Reacts to a message sent by one of the players in the room."""
+
+		kind = message[0]
+		other_player = self.other(player)
+
+		if kind == PLAYED: #Player played. If the move is allowed, send both the 'PLAYED cell_index' message
+			index = message[1]
+			if not self.is_full() or self.players[self.turn] is not player or not self.is_legal(index):
+				player.send_message(encode_rejected(index))
+				return
+			self.log_move(index)
+			frame = encode_played(index)
+			player.send_message(frame)
+			other_player.send_message(frame)
+			self.broadcast(frame)
+
+		elif kind == RESTART: #Player restarted game. Send both the 'CREATE rival_name order' message
+			if self.is_full():
+				self.setup_game()
+
+		elif kind == CLOSING: #Player is leaving the game, only its rival is told
+			player.left = True
+			if other_player is not None:
+				other_player.send_message(CLOSING_FRAME)
+
+		else:
+			pass
+
+
+	def log_move(self, index):
+		"""Plays the move and records it, and the end of the game if it is over, in the log."""
+
+		turn, ply = self.turn, len(self.moves)
+		result = self.play(index)
+		self.moves.append(index)
+
+		if self.game is not None:
+			self.log.move(self.game, ply, turn, index)
+			if result != ONGOING:
+				self.log.end(self.game, ply + 1, result, turn if result == WIN else None)
+				self.game = None
+
+
+	def log_abandoned(self):
+		"""Records the game being played as abandoned, if it is logged and isn't over."""
+
+		if self.game is not None:
+			self.log.end(self.game, (self.masks[X] | self.masks[O]).bit_count(), ABANDONED)
+			self.game = None
+
+
+	def remove_player(self, player):
+		"""Takes the player out of the room. If the player dropped without saying CLOSING, the rival is told anyway."""
+
+		other_player = self.other(player)
+		self.players.remove(player)
+		player.room = None
+		self.log_abandoned()
+		self.broadcast(CLOSING_FRAME)
+
+		if other_player is not None and not player.left:
+			other_player.send_message(CLOSING_FRAME)
+
+
+	def add_spectator(self, spectator):
+		"""Lets the spectator watch the room, starting with the board as it is now."""
+
+		if self.spectators is None:
+			self.spectators = set()
+
+		self.spectators.add(spectator)
+		spectator.watching = self
+		spectator.send_message(self.snapshot())
+
+
+	def remove_spectator(self, spectator):
+
+		self.spectators.discard(spectator)
+		spectator.watching = None
+
+
+	def resumed(self, player, first):
+		"""RESUMED frame for a player back in its seat, with the moves of the current game from first on."""
+
+		seat = self.players.index(player)
+		rival = self.other(player)
+		size, win_length = self.geometry.size, self.geometry.win_length
+
+		return encode_resumed(self.games, rival.name, ORDERS[seat], size, win_length, first, self.moves[first:])
+
+
+	def snapshot(self):
+		"""WATCHING frame with the players and the board as it is now."""
+
+		if self.is_full():
+			names = (self.players[X].name, self.players[O].name)
+		else: #The other player left, and which seat it had doesn't matter anymore
+			names = (self.players[0].name if self.players else "", "")
+
+		return encode_watching(*names, self.geometry.size, self.geometry.win_length, cells(self.masks[X]), cells(self.masks[O]))
+
+
+	def broadcast(self, frame):
+		"""Sends the frame to every spectator. It is the same bytes object for all of them, which is only
+		queued on each spectator's transport, so a slow spectator never holds anyone up. What happens to
+		spectators that fall behind depends on the server's spectator policy."""
+
+		if self.spectators:
+			for spectator in self.spectators:
+				spectator.send_message(frame)
+
+
+
+class PlayerConnection(asyncio.BufferedProtocol):
+
+
+	def __init__(self, server):
+		"""One of these is created by the event loop for every accepted connection. The player opens with a
+		HELLO frame carrying its name, and is then handed to the server to be seated in a room, so nothing has
+		to be asked. Incoming bytes are read straight into the decoder's buffer, which is reused for the whole
+		connection. The connection is the player of channel 0. Frames on any other channel belong to a
+		PlayerChannel of their own, created when the first one arrives, so one connection can play many games."""
+
+		self.server = server
+		self.transport = None
+		self.peer = None
+		self.decoder = FrameDecoder(256) #Frames are a few bytes long. The buffer grows if a bigger one comes
+		self.name = None
+		self.capabilities = 0
+		self.variant = (0, 0) #Board size and win length the player would like, 0 for any
+		self.rating = None
+		self.room = None
+		self.left = False
+		self.token = None #Session token of the player's seat, if it can resume it
+		self.expiry = None #Timer that gives the seat up, while the player is away
+		self.watching = None #Room this connection is watching, for spectators
+		self.channels = None #Channel number to its PlayerChannel, once a frame comes on a channel other than 0
+		self.policy = DISCONNECT #What to do when the peer falls behind
+		self.lagging = False #More than the high watermark is waiting to be sent
+		self.dropped = 0 #Frames skipped while lagging
+		self.state = None #Set by the server's ConnectionManager
+		self.connected = 0
+		self.last_seen = 0
+		self.last_ping = 0
+		self.joined = 0
+
+
+	def connection_made(self, transport):
+
+		self.transport = transport
+		self.joined = time.perf_counter()
+		self.peer = transport.get_extra_info('peername')
+		self.set_policy(DISCONNECT, PLAYER_WATERMARKS)
+
+		sock = transport.get_extra_info('socket')
+		if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+			#asyncio leaves Nagle on for accepted sockets, which holds small frames back behind unacknowledged ones
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+		self.server.connections.register(self)
+		print(f"Joined {self.peer}")
+
+
+	def get_buffer(self, sizehint):
+
+		return self.decoder.get_buffer(sizehint)
+
+
+	def buffer_updated(self, nbytes):
+
+		self.decoder.buffer_updated(nbytes)
+		self.last_seen = time.monotonic()
+
+		try:
+			for message in self.decoder.messages():
+				started = time.perf_counter()
+				MESSAGES.inc(NAMES.get(message[0]))
+				channel = self.decoder.channel
+				player = self.open_channel(channel) if channel else self
+				if player is not None:
+					player.handle_message(message)
+				MESSAGE_TIME.time(started)
+		except (ProtocolError, UnicodeDecodeError) as e:
+			print(f"Dropped player {self.name} for sending an invalid frame. {e}")
+			self.transport.abort()
+
+
+	def handle_message(self, message):
+
+		kind = message[0]
+
+		if kind == PING:
+			self.send_message(PONG_FRAME)
+
+		elif kind == PONG: #Peer is alive, which was already noted when the frame arrived
+			pass
+
+		elif self.watching is not None: #Spectators only answer heartbeats
+			pass
+
+		elif kind == LEAVE: #Player is done with its room, but not with the connection
+			self.server.leave(self)
+
+		elif self.name is None and kind == WATCH: #Spectators open with WATCH instead of HELLO
+			self.server.watch(self, message[1])
+
+		elif self.name is None and kind == RESUME: #Players whose connection dropped open with RESUME instead of HELLO
+			self.server.resume(self, *message[1:])
+
+		elif self.name is None: #First message must be HELLO
+			if kind != HELLO or not message[1]:
+				raise ProtocolError("Connection didn't start with HELLO")
+			_, self.name, self.capabilities, size, win_length, self.rating = message
+			self.variant = (size, win_length)
+			HANDSHAKES.inc()
+			if self.state == HANDSHAKING: #Not a player saying HELLO again after LEAVE, long after connecting
+				HANDSHAKE_TIME.time(self.joined)
+			print(f"Server accepted player {self.name}")
+			self.server.seat_player(self)
+
+		elif self.room is not None:
+			self.room.handle_message(self, message)
+
+
+	def open_channel(self, channel):
+		"""Returns the player of the given channel of this connection, creating it on first use. If the connection
+		already has as many channels as the server allows, the channel is answered with CLOSING and None is
+		returned."""
+
+		if self.channels is None:
+			self.channels = {}
+
+		player = self.channels.get(channel)
+
+		if player is None:
+			if len(self.channels) >= self.server.max_channels:
+				self.send_message(on_channel(CLOSING_FRAME, channel))
+				return None
+			player = self.channels[channel] = PlayerChannel(self, channel)
+
+		return player
+
+
+	def set_policy(self, policy, watermarks):
+		"""Decides what happens when more than the high watermark of bytes is waiting to be sent to the peer.
+		Watermarks is a (low, high) tuple."""
+
+		low, high = watermarks
+		self.policy = policy
+		self.transport.set_write_buffer_limits(high, low)
+
+
+	def pause_writing(self):
+		"""Called by the transport when the backlog goes past the high watermark."""
+
+		if self.policy == DISCONNECT:
+			self.server.connections.reap(self, f"fell {self.transport.get_write_buffer_size()} bytes behind")
+		else:
+			self.lagging = True
+
+
+	def resume_writing(self):
+		"""Called by the transport when the backlog is down to the low watermark."""
+
+		self.lagging = False
+
+		if self.dropped and self.watching is not None: #Frames were skipped, so the spectator catches up in one go
+			self.dropped = 0
+			try:
+				self.send_message(self.watching.snapshot())
+			except ProtocolError as e: #Board grew too big to send in one frame, so it can't be caught up
+				print(f"Spectator {self.peer} can't catch up with room {self.watching.room_id}. {e}")
+				self.close()
+
+
+	def eof_received(self):
+		"""Peer closed its side in an orderly way. Returning None lets the transport close ours too."""
+
+		self.state = CLOSING_STATE
+
+
+	def connection_lost(self, exc):
+
+		self.server.connections.unregister(self)
+		self.server.remove_player(self)
+
+		for player in list((self.channels or {}).values()):
+			player.drop()
+
+
+	def send_message(self, frame):
+		"""Queues a frame on the transport, which sends it as soon as the socket takes it, without blocking."""
+
+		if self.lagging:
+			self.dropped += 1
+		elif not self.transport.is_closing():
+			self.transport.write(frame)
+
+
+	def close(self):
+
+		self.transport.close()
+
+
+	def abort(self):
+		"""Drops the connection right away, for a player whose seat was taken over by a new connection."""
+
+		self.transport.abort()
+
+
+
+class PlayerChannel(PlayerConnection):
+
+
+	def __init__(self, connection, channel):
+		"""Player of one channel of a connection other than channel 0, which is the connection itself. It is
+		seated, paired and resumed like any player, and its frames are sent over the connection tagged with
+		its channel. Heartbeats, idle timeouts and slow readers are handled for the whole connection."""
+
+		super().__init__(connection.server)
+		self.connection = connection
+		self.channel = channel
+		self.transport = connection.transport
+		self.peer = (connection.peer, channel)
+		self.decoder = None #Frames are decoded by the connection
+		self.state = HANDSHAKING
+		self.joined = time.perf_counter()
+
+
+	def handle_message(self, message):
+
+		if not self.server.multiplexing:
+			self.send_message(CLOSING_FRAME)
+			return
+
+		super().handle_message(message)
+
+		if self.state not in (HANDSHAKING, CLOSED) and self.connection.state == HANDSHAKING:
+			self.connection.state = IDLE #Has proven itself through this channel, so only heartbeats apply now
+
+
+	def set_policy(self, policy, watermarks): #The connection's own policy covers its channels
+
+		pass
+
+
+	def send_message(self, frame):
+
+		self.connection.send_message(on_channel(frame, self.channel))
+
+
+	def close(self):
+		"""Turns the player of this channel away with CLOSING. The connection and its other channels go on."""
+
+		self.send_message(CLOSING_FRAME)
+		self.drop()
+
+
+	def abort(self):
+
+		self.forget()
+
+
+	def drop(self):
+		"""Does for the channel what connection_lost does for a connection."""
+
+		self.forget()
+		self.state = CLOSED
+		self.server.remove_player(self)
+
+
+	def forget(self):
+
+		if self.connection.channels.get(self.channel) is self:
+			del self.connection.channels[self.channel]
 
 
 
 class Server():
 
+	multiplexing = True #Whether players may play several games at once over one connection, on channels
+
 	
-	def __init__(self, ip_address, port):
+	def __init__(self, ip_address, port, max_rooms=None, heartbeat_interval=10, idle_timeout=30, size=3, win_length=3, variants=(),
+		game_log=None, spectator_policy=DROP, resume_timeout=30, max_channels=64):
+		"""Binds the listening socket right away, so that errors such as a port in use are raised to the caller.
+		Players are served on an asyncio event loop once accept_players (or serve) runs. Players wait in the
+		lobby until they are paired with a rival, and each pair gets a new room. max_rooms limits how many
+		rooms can be open at once. Connections quiet for heartbeat_interval seconds are pinged, and dropped
+		after idle_timeout. Rooms play on a size x size board with win_length in a row to win, unless the
+		player asks for one of the (size, win_length) tuples in variants. If port is None nothing is bound,
+		for servers whose players are handed to them rather than accepted (see supervisor.py). Games are recorded
+		in game_log if a GameLogWriter is given. It is flushed while the server runs, and closing it is left
+		to the caller. Spectators that fall behind are handled according to spectator_policy (DROP or
+		DISCONNECT), and players that do are disconnected. Players that can resume (CAP_RESUME) keep their
+		seat for resume_timeout seconds after their connection drops, and the rival waits for them meanwhile.
+		A resume_timeout of 0 turns resuming off. A connection may play on up to max_channels channels other
+		than 0 at once, and further channels are answered with CLOSING."""
+
+		if spectator_policy not in POLICIES:
+			raise ValueError(f"Unknown policy '{spectator_policy}'")
+
+		self.variants = [(size, win_length)] + [tuple(v) for v in variants if tuple(v) != (size, win_length)]
+
+		for variant in self.variants:
+			geometry(*variant) #Raises ValueError for boards that can't be played
 
 		self.ip_address = ip_address
 		self.port = port
-		self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM) #Creates the server client
-		self.client.bind((self.ip_address, self.port))
-		self.client.listen() #Makes the server listen for incoming stuff
+		self.max_rooms = max_rooms
+		self.game_log = game_log
+		self.spectator_policy = spectator_policy
+		self.resume_timeout = resume_timeout
+		self.max_channels = max_channels
+		self.size = size
+		self.win_length = win_length
+		self.client = None
 
-		self.player_clients = []
-		self.player_names = []
+		if port is not None:
+			self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM) #Creates the server client
+			#Lets a restarted server bind while old connections linger. Unix only: on Windows another server could take the port
+			if os.name == "posix":
+				self.client.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+			self.client.bind((self.ip_address, self.port))
+			self.client.listen(socket.SOMAXCONN) #Makes the server listen for incoming stuff. Big backlog for bursts of players
+			self.client.setblocking(False)
+
+		self.rooms = {}
+		self.sessions = {} #Session token to the player holding the seat, connected or not
+		self.lobby = MatchQueue(owner=owner)
+		self.room_ids = itertools.count(1)
+		self.connections = ConnectionManager(heartbeat_interval, idle_timeout)
+		self.loop = None
+		self.stopped = None
+		self.closed = False
 
 
 	def accept_players(self):
-		"""Accepts two players, and saves their names and addresses, and creates a thread to listen to each one."""
+		"""Runs the server on a new event loop in the calling thread, until close() is called."""
 
-		while len(self.player_clients) < 2:
+		loop = asyncio.new_event_loop()
 
-			client, address = self.client.accept() #Players connect and information is saved.
-			print(f"Joined {client} with {address}")
-			time.sleep(0.5)
-			self.send_message(client, "NAME")
-			name = client.recv(1024).decode("ascii")
-			self.player_clients.append(client)
-			self.player_names.append(name)
-			print(f"Server accepted player {name}")
+		try:
+			loop.run_until_complete(self.serve())
+		finally:
+			loop.close()
 
-		#Starts two threads to listen to each player's individual messages.
-		threading.Thread(target=self.listen_for_messages, args=(self.player_clients[0], self.player_clients[1])).start()
-		threading.Thread(target=self.listen_for_messages, args=(self.player_clients[1], self.player_clients[0])).start()
 
-		self.setup_game()
+	async def serve(self):
+		"""Accepts players and serves every room until close() is called."""
 
+		self.loop = asyncio.get_running_loop()
+		self.stopped = asyncio.Event()
 
-	def setup_game(self):
-		"""Decides which player will begin and sends each player the 'CREATE rival_name order' message"""
-
-		first = random.choice(self.player_clients)
-		second = self.player_clients[1] if first == self.player_clients[0] else self.player_clients[0]
+		if self.closed: #Server was closed before it got to run
+			if self.client is not None:
+				self.client.close()
+			return
 
-		first_name = self.player_names[self.player_clients.index(first)]
-		second_name = self.player_names[self.player_clients.index(second)]
+		server = None
+		if self.client is not None:
+			server = await self.loop.create_server(self.accept, sock=self.client, backlog=socket.SOMAXCONN)
+		reaper = self.loop.create_task(self.connections.run())
+		flusher = self.loop.create_task(self.game_log.run()) if self.game_log is not None else None
 
 		try:
-			self.send_message(first, f"CREATE {second_name} first")
-		except Exception as e:
-			print(f"Couldn't send create message to {first_name}")
-			first.close()
-			self.player_clients.remove(first)
-			raise e
+			await self.stopped.wait()
+		finally:
+			reaper.cancel()
+
+			for connection in list(self.connections.connections):
+				connection.close()
+
+			if flusher is not None:
+				flusher.cancel()
+				self.game_log.flush()
+
+			if server is not None:
+				server.close()
+				await server.wait_closed()
+
+
+	def accept(self):
+		"""Protocol for a connection accepted on the listening socket."""
+
+		ACCEPTS.inc()
+
+		return PlayerConnection(self)
+
+
+	def report(self):
+		"""Returns the state of every connection. See ConnectionManager.report."""
+
+		return self.connections.report()
+
+
+	def health(self):
+		"""Returns a summary of the load on the server."""
+
+		return {
+			"connections": len(self.connections.connections),
+			"queued": len(self.lobby),
+			"rooms": len(self.rooms),
+			"reaped": self.connections.reaped
+		}
+
+
+	def metrics(self):
+		"""Returns the metrics of the server in the Prometheus text format."""
+
+		return metrics.REGISTRY.render()
+
+
+	def close(self):
+		"""Stops the server. It can be called from any thread."""
+
+		self.closed = True
+
+		if self.loop is not None and not self.loop.is_closed():
+			self.loop.call_soon_threadsafe(self.stopped.set)
+		elif self.client is not None:
+			self.client.close()
+
+
+	def choose_variant(self, player):
+		"""Board the player will play on: the one it asked for if this server hosts it, the default one
+		otherwise. Returns None if the player can't play on any board this server hosts."""
+
+		size, win_length = player.variant
+		variant = (size, win_length or size)
+
+		if variant not in self.variants:
+			variant = self.variants[0]
+
+		if variant != (3, 3) and not player.capabilities & CAP_VARIANTS:
+			variant = (3, 3) if (3, 3) in self.variants else None
+
+		return variant
+
+
+	def seat_player(self, player):
+		"""Pairs the player with a rival waiting in the lobby and opens a room for both, in which the game
+		begins. If there is no rival yet, the player waits in the lobby."""
+
+		variant = self.choose_variant(player)
+
+		if variant is None:
+			print(f"Player {player.name} can't play on any board this server hosts and was turned away.")
+			player.close()
+			return
+
+		if self.max_rooms is not None and len(self.rooms) >= self.max_rooms:
+			print(f"Room limit reached. Player {player.name} was turned away.")
+			player.close()
+			return
+
+		rival = self.lobby.enqueue(player, variant, player.rating)
+
+		if rival is None:
+			player.state = QUEUED
+			return
+
+		self.open_room(variant, (rival, player))
+
+
+	def open_room(self, variant, players, room_id=None):
+		"""Opens a room on the given (size, win_length) board for both players and begins the game."""
+
+		room = Room(next(self.room_ids) if room_id is None else room_id, *variant, self.game_log)
+		self.rooms[room.room_id] = room
+
+		for p in players:
+			room.add_player(p)
+			p.state = OPEN
+			if self.resume_timeout and p.capabilities & CAP_RESUME:
+				p.token = session_token(room.room_id)
+				self.sessions[p.token] = p
+
+		room.setup_game()
+
+
+	def remove_player(self, player):
+		"""Called when a player's connection is lost. Rooms are discarded once they are empty."""
+
+		room = player.room
+
+		if player.watching is not None:
+			player.watching.remove_spectator(player)
+			return
+
+		if room is None:
+			self.lobby.cancel(player)
+			return
+
+		if player.token is not None and player.state == CLOSED and not player.left and room.is_full():
+			self.suspend(player)
+			return
+
+		self.end_session(player)
+		room.remove_player(player)
+
+		for other in list(room.players): #Nobody is left to wait for a player that is away
+			if other.expiry is not None:
+				SESSIONS.inc("expired")
+				self.end_session(other)
+				room.remove_player(other)
+
+		if len(room.players) == 0:
+			self.close_room(room)
+
+
+	def suspend(self, player):
+		"""Keeps the seat of a player whose connection dropped, in case it comes back with its token."""
+
+		print(f"Holding the seat of player {player.name} for {self.resume_timeout} seconds")
+		player.expiry = self.loop.call_later(self.resume_timeout, self.expire, player)
+
+
+	def expire(self, player):
+		"""Gives up the seat of a player that didn't come back in time, which ends its game."""
+
+		player.expiry = None
+		SESSIONS.inc("expired")
+		self.end_session(player)
+		self.remove_player(player)
+
+
+	def end_session(self, player):
+
+		if player.token is not None:
+			self.sessions.pop(player.token, None)
+			player.token = None
+
+		if player.expiry is not None:
+			player.expiry.cancel()
+			player.expiry = None
+
+
+	def resume(self, connection, token, game, seen):
+		"""Seats a reconnecting player back in its room, in place of its old connection, and tells it what it
+		missed: only the moves played while it was away if it was in the same game, the whole game otherwise.
+		If the seat is gone, or the rival is, the player is told the game is over with CLOSING, and may send
+		HELLO to play again. So is a player whose missed moves don't fit in one frame, while the seat is held
+		until it expires."""
+
+		player = self.sessions.get(token)
+		room = player.room if player is not None else None
+
+		if room is None or not room.is_full():
+			if player is not None:
+				self.expire(player) #Rival left while the player was away
+			else:
+				SESSIONS.inc("refused")
+			connection.state = IDLE
+			connection.send_message(CLOSING_FRAME)
+			return
+
+		first = seen if game == room.games and seen <= len(room.moves) else 0
 
 		try:
-			self.send_message(second, f"CREATE {first_name} second")
-		except Exception as e:
-			print(f"Couldn't send create message to {second_name}")
-			second.close()
-			self.player_clients.remove(second)
-			raise e
+			frame = room.resumed(player, first)
+		except ProtocolError as e: #Long game on a large board
+			SESSIONS.inc("refused")
+			print(f"Player {player.name} can't resume its seat. {e}")
+			connection.state = IDLE
+			connection.send_message(CLOSING_FRAME)
+			return
+
+		if player.expiry is not None:
+			player.expiry.cancel()
+			player.expiry = None
+
+		#The old connection may not have been noticed to be dead yet. It loses the seat either way
+		room.players[room.players.index(player)] = connection
+		player.room = None
+		player.token = None
+		player.abort()
+
+		connection.name = player.name
+		connection.capabilities = player.capabilities
+		connection.variant = player.variant
+		connection.rating = player.rating
+		connection.room = room
+		connection.token = token
+		connection.state = OPEN
+		self.sessions[token] = connection
+		SESSIONS.inc("resumed")
+		print(f"Player {connection.name} resumed its seat")
+
+		connection.send_message(frame)
+
+
+	def leave(self, player):
+		"""Takes the player out of its room, telling the rival, or out of the lobby, and echoes LEAVE once done.
+		The connection stays open and the player may send HELLO again to be paired with someone new, without
+		connecting again."""
 
+		if player.name is not None:
+			self.remove_player(player)
 
-	def send_message(self, client, message):
-		"""Handles sending a message to a client"""
+		self.end_session(player)
+		player.name = None
+		player.left = False
+		player.state = IDLE
+		player.send_message(LEAVE_FRAME)
 
-		if bytes != type(message):
-			message = message.encode("ascii")
+
+	def close_room(self, room):
+		"""Discards a room nobody is left in, and sends its spectators away."""
+
+		del self.rooms[room.room_id]
+
+		for spectator in list(room.spectators or ()):
+			spectator.close()
+
+
+	def watch(self, spectator, room_id):
+		"""Lets the spectator watch the room with the given id, or closes its connection if there is no such room
+		or its board is too big to send."""
+
+		room = self.rooms.get(room_id)
+
+		if room is None:
+			print(f"Spectator {spectator.peer} asked for room {room_id}, which isn't open.")
+			spectator.close()
+			return
+
+		spectator.state = SPECTATING
+		spectator.set_policy(self.spectator_policy, SPECTATOR_WATERMARKS)
 
 		try:
-			client.send(message)
-		except Exception as e:
-			print(f"Couldn't send message {message.decode('ascii')} to {client}")
-			client.close()
-			print(e)
+			room.add_spectator(spectator)
+		except ProtocolError as e: #Board of a long game on a large board doesn't fit in one frame
+			room.remove_spectator(spectator)
+			print(f"Spectator {spectator.peer} can't watch room {room_id}. {e}")
+			spectator.close()
+
+
+
+class SendQueue():
+
+
+	def __init__(self, sock, policy=DISCONNECT, watermarks=PLAYER_WATERMARKS, on_error=None):
+		"""Outgoing frames of a blocking socket, sent by a thread of their own so that put never blocks the
+		caller (the Tk thread, for the player's client). Frames queued while the thread is busy go out
+		together in the next write. Once more than the high watermark of bytes is waiting, put refuses frames
+		with the DISCONNECT policy, or skips them with DROP until the backlog is down to the low watermark.
+		On_error is called, from the sending thread, if the socket fails."""
+
+		self.sock = sock
+		self.policy = policy
+		self.low, self.high = watermarks
+		self.on_error = on_error
+		self.frames = deque()
+		self.size = 0 #Bytes waiting, including those being sent
+		self.lagging = False
+		self.dropped = 0
+		self.closed = False
+		self.condition = threading.Condition()
+
+
+	def start(self):
+
+		threading.Thread(target=self.send_frames, daemon=True).start()
+
+
+	def put(self, frame):
+		"""Queues the frame. Returns False if it was refused because the peer fell too far behind, or the queue
+		is closed."""
+
+		with self.condition:
+			if self.closed:
+				return False
+
+			if self.size + len(frame) > self.high:
+				if self.policy == DISCONNECT:
+					return False
+				self.lagging = True
+
+			if self.lagging:
+				self.dropped += 1
+				return True
+
+			self.frames.append(frame)
+			self.size += len(frame)
+			self.condition.notify()
+
+		return True
 
-	
-	def listen_for_messages(self, client, other_client):
+
+	def send_frames(self):
+		"""Runs on the sending thread until the queue is closed and empty."""
 
 		while True:
+			with self.condition:
+				self.condition.wait_for(lambda: self.frames or self.closed)
+				if not self.frames:
+					return
+				data = b"".join(self.frames)
+				self.frames.clear()
 
 			try:
-				message = client.recv(1024)
-			except Exception as e:
-				print("Something went wrong when receiving message from a client. Client was removed.")
-				client.close()
-				self.player_clients.remove(client)
-				print(e)
-				break
+				self.sock.sendall(data)
+			except OSError:
+				with self.condition:
+					self.closed = True
+					self.frames.clear()
+					self.size = 0
+					self.condition.notify_all()
+				if self.on_error is not None:
+					self.on_error()
+				return
 
-			message = message.decode("ascii")
+			with self.condition:
+				self.size -= len(data)
+				if self.lagging and self.size <= self.low:
+					self.lagging = False
+				self.condition.notify_all()
 
-			if message == "CLOSING": #Player is leaving the game
-				self.client.close()
-				self.send_message(other_client, message)
 
-			elif message[:7] == "RESTART": #Player restarted game. Send both the 'CREATE rival_name order' message
-				self.setup_game()
+	def close(self, timeout=0):
+		"""Stops taking frames, and waits up to timeout seconds for the ones already queued to be sent. Returns
+		True if they were all sent."""
 
-			elif message[:6] == "PLAYED": #Player played. Send both the 'PLAYED cell_index' message
-				self.send_message(client, message)
-				self.send_message(other_client, message)
+		with self.condition:
+			self.closed = True
+			self.condition.notify_all()
+			sent = self.condition.wait_for(lambda: self.size == 0, timeout)
+			self.frames.clear()
+
+		return sent
+
+
+
+class ClientChannel():
+
+
+	def __init__(self, client, channel, calling_method, on_disconnect=None):
+		"""One game played over a PlayerClient's connection. Channel 0 is the client's own game, and more are
+		opened with PlayerClient.open_channel to play several games over the same connection. Frames sent
+		through the channel are tagged with it, and the messages tagged with it are handed to calling_method,
+		on the client's listening thread. On_disconnect is called if the connection is lost."""
+
+		self.client = client
+		self.channel = channel
+		self.calling_method = calling_method
+		self.on_disconnect = on_disconnect
+		self.free = False #Closed, and waiting to be opened again
+		self.leaving = 0 #LEAVEs sent that the server hasn't echoed yet
+		self.session = None #(token, game number) of the seat the player can resume
+		self.seen = 0 #Moves of that game received so far
+
+
+	def deliver(self, message):
+		"""Handles a message that came on this channel."""
+
+		kind = message[0]
+
+		if kind == LEAVE:
+			self.leaving -= 1
+		elif self.leaving: #Until LEAVE is echoed, messages are from the game left
+			pass
+		elif kind == SESSION:
+			self.session = (message[1], message[2])
+		else:
+			self.track(message)
+			calling_method = self.calling_method
+			if calling_method is not None:
+				calling_method(message)
+
+
+	def track(self, message):
+		"""Keeps count of the moves of the current game, which the server is told when the game is resumed."""
+
+		kind = message[0]
+
+		if kind == PLAYED:
+			self.seen += 1
+		elif kind == CREATE:
+			self.seen = 0
+		elif kind == RESUMED:
+			self.session = (self.session[0], message[1])
+			self.seen = message[6] + len(message[7])
+		elif kind == CLOSING: #Game is over, and there is no seat to go back to
+			self.session = None
+
+
+	def send_message(self, *frames):
+		"""Queues one or more frames for this channel's game. See PlayerClient.send_message."""
+
+		if self.channel:
+			self.client.send_message(on_channel(b"".join(frames), self.channel))
+		else:
+			self.client.send_message(*frames)
+
+
+	def attach(self, calling_method, on_disconnect=None):
+		"""Hands the messages of the channel and the disconnection to new callbacks, when it is reused for another
+		game. Either may be None."""
+
+		self.calling_method = calling_method
+		self.on_disconnect = on_disconnect
+
+
+	def leave(self):
+		"""Leaves the room, or the lobby, while keeping the channel, so that HELLO can be sent on it again. The
+		messages of the game left behind are dropped."""
+
+		self.leaving += 1
+		self.session = None
+		self.send_message(LEAVE_FRAME)
+
+
+	def close(self):
+		"""Leaves the channel's game and stops delivering its messages. The channel is reused by the next
+		open_channel, so the server doesn't keep a seat around for every game ever played."""
+
+		self.attach(None)
+		self.leave()
+		self.free = True
 
-			else:
-				pass
-			
 
 
 class PlayerClient:
 
 
-	def __init__(self, ip_address, port, calling_method):
+	def __init__(self, ip_address, port, calling_method, on_disconnect=None, idle_timeout=30, resume_timeout=10):
 		"""Create the player client that will connect to the server client and allow communication.
 		The ip address and port that it gets is from the server. Calling_method is a method form PlayerFrame
-		classs that will be called whenever a new message comes in."""
+		classs that will be called whenever a new message comes in. On_disconnect is called once if the
+		connection is lost, either because the server closed it or because it went silent for idle_timeout
+		seconds (the server pings well before that), but not when the client closes it itself.
+		If the connection drops in the middle of a game the server gave a session token for, the client
+		reconnects for up to resume_timeout seconds and asks for its seat back, and calling_method gets the
+		RESUMED answer. The connection is only reported lost if that fails.
+		Calling_method gets the messages of channel 0. Other games can be played at the same time over the
+		same connection on channels from open_channel, each with callbacks of its own."""
 
 		self.ip_address = ip_address
 		self.port = port
-		self.calling_method = calling_method
+		self.idle_timeout = idle_timeout
+		self.resume_timeout = resume_timeout
+		self.decoder = FrameDecoder()
+		self.state = "connecting"
+		self.lock = threading.Lock()
+		self.channels = [ClientChannel(self, 0, calling_method, on_disconnect)] #By channel number
 
 		self.client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.queue = SendQueue(self.client, on_error=lambda sock=self.client: self.break_off(sock))
 		
 
 	def listen_to_incoming_messages(self):
 		"""This method runs on a separate thread and will be listening for any message that the server client sends,
-		then calls the calling_method passing such message as an argument."""
+		then calls the calling_method passing such message as an argument. Several messages may arrive in one
+		read, and a message may be split across reads, so the calling_method is called once per complete frame.
+		When the connection drops, the game is resumed over a new one if possible."""
 		
+		while True:
+			self.receive()
+			if not self.resume():
+				break
+
+		self.connection_lost()
+
+
+	def receive(self):
+		"""Reads messages until the connection fails or the server closes it, and hands each to its channel."""
+
 		while True:
 			try:
-				message = self.client.recv(1024).decode("ascii")
-				self.calling_method(message)
+				nbytes = self.client.recv_into(self.decoder.get_buffer())
+				if nbytes == 0: #Server closed the connection
+					return
+				self.decoder.buffer_updated(nbytes)
+				for message in self.decoder.messages():
+					kind = message[0]
+					if kind == PING:
+						self.send_message(PONG_FRAME)
+					elif kind != PONG and self.decoder.channel < len(self.channels):
+						self.channels[self.decoder.channel].deliver(message)
 			except Exception:
-				self.client.close()
-				break
+				return
+
+
+	def resume(self):
+		"""Connects again after the connection dropped in the middle of a game, and asks for the seats of every
+		channel that was playing one back with RESUME. Attempts back off for up to resume_timeout seconds.
+		Returns False if there is no game to go back to, the client was closed or the server couldn't be
+		reached. Channels that weren't playing are told the connection was lost, since the server forgot them."""
+
+		with self.lock:
+			if self.state != "open" or not self.resume_timeout or all(c.session is None for c in self.channels):
+				return False
+			self.state = "resuming"
+
+		self.queue.close(0)
+		self.break_off(self.client)
+		self.client.close()
+
+		deadline = time.monotonic() + self.resume_timeout
+		delay = 0.1
+
+		while self.state == "resuming" and time.monotonic() < deadline:
+			try:
+				sock = socket.create_connection((self.ip_address, self.port), max(0.1, deadline - time.monotonic()))
+			except OSError:
+				time.sleep(delay)
+				delay = min(delay * 2, 2)
+				continue
+
+			sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+			sock.settimeout(self.idle_timeout)
+
+			with self.lock:
+				if self.state != "resuming": #Closed meanwhile
+					sock.close()
+					return False
+				self.client = sock
+				self.decoder = FrameDecoder()
+				self.queue = SendQueue(sock, on_error=lambda: self.break_off(sock))
+				self.state = "open"
+
+			self.queue.start()
+
+			for channel in self.channels:
+				channel.leaving = 0 #LEAVEs still on their way were lost, and the server forgot those games anyway
+				if channel.session is not None:
+					token, game = channel.session
+					channel.send_message(encode_resume(token, game, channel.seen))
+				elif not channel.free and channel.on_disconnect is not None:
+					channel.on_disconnect()
+
+			return True
+
+		return False
+
+
+	def break_off(self, sock):
+		"""Shuts the socket down, so that the listening thread finds out it failed."""
+
+		try:
+			sock.shutdown(socket.SHUT_RDWR)
+		except OSError:
+			pass
 
 
 	def connect_to_server(self):
@@ -145,23 +1187,199 @@ class PlayerClient:
 
 		try:
 			self.client.connect((self.ip_address, self.port))
+			self.client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1) #Frames are tiny, don't hold them back
+			self.client.settimeout(self.idle_timeout)
+			self.state = "open"
+			self.queue.start()
 			threading.Thread(target=self.listen_to_incoming_messages).start()
 		except Exception as e:
-			self.client.close()
+			self.close()
 			raise e
 
 
-	def send_message(self, message):
-		"""Sends the message to the server."""
+	def open_channel(self, calling_method, on_disconnect=None):
+		"""Returns a ClientChannel to play another game over this connection, reusing a closed one if there is
+		any. Messages of its game go to calling_method."""
 
-		try: 
-			if bytes != type(message):
-				message = message.encode("ascii")
-		except Exception as e:
-			raise e
+		with self.lock:
+			channel = next((channel for channel in self.channels if channel.free), None)
+
+			if channel is None:
+				if len(self.channels) > MAX_CHANNEL:
+					raise ValueError("Every channel of the connection is in use")
+				channel = ClientChannel(self, len(self.channels), calling_method, on_disconnect)
+				self.channels.append(channel)
+
+			channel.attach(calling_method, on_disconnect)
+			channel.free = False
+
+		return channel
+
+
+	def send_message(self, *frames):
+		"""Queues one or more frames for the server, without waiting for them to be sent. Several frames go
+		out in a single write. If the server stops reading and too much piles up, the connection is dropped.
+		Frames sent while the client reconnects are lost."""
+
+		message = frames[0] if len(frames) == 1 else b"".join(frames)
+
+		if self.state == "closed" or self.state == "resuming":
+			return
+
+		if not self.queue.put(message):
+			self.break_off(self.client)
+
+
+	def attach(self, calling_method, on_disconnect=None):
+		"""Hands the messages of channel 0 and the disconnection to new callbacks, when the client is reused for
+		another game. Either may be None."""
+
+		self.channels[0].attach(calling_method, on_disconnect)
+
+
+	def leave(self):
+		"""Leaves the game of channel 0. See ClientChannel.leave."""
+
+		self.channels[0].leave()
+
+
+	def connection_lost(self):
+		"""Closes the connection and calls the on_disconnect of every channel, unless the client closed it first."""
+
+		with self.lock:
+			lost = self.state != "closed"
+			self.state = "closed"
+
+		if lost:
+			self.shut_down(0)
+			for channel in self.channels:
+				if channel.on_disconnect is not None:
+					channel.on_disconnect()
+
+
+	def close(self, timeout=1):
+		"""Closes the connection, once the frames already queued (such as CLOSING) are sent or timeout seconds
+		have passed. The listening thread then stops without reporting a disconnection. If the player is in a
+		game, the server is told it isn't coming back, so the rival needn't wait for it."""
+
+		with self.lock:
+			if self.state == "closed":
+				return
+			if self.state == "resuming": #Nothing can be sent until the game is resumed
+				timeout = 0
+			else:
+				for channel in self.channels:
+					if channel.session is not None:
+						self.queue.put(on_channel(CLOSING_FRAME, channel.channel) if channel.channel else CLOSING_FRAME)
+			self.state = "closed"
+
+		self.shut_down(timeout)
+
+
+	def shut_down(self, timeout):
+
+		self.queue.close(timeout)
 
 		try:
-			self.client.send(message)
-		except Exception as e:
-			self.client.close()
-			raise e
\ No newline at end of file
+			self.client.shutdown(socket.SHUT_RDWR) #Wakes up the listening thread if it is blocked in recv
+		except OSError:
+			pass
+
+		self.client.close()
+
+
+
+class ConnectionPool():
+
+
+	def __init__(self, size=2, idle_timeout=30):
+		"""Clients kept connected to their servers between games, so that playing again on a server skips
+		connecting and goes straight to HELLO. Up to size idle clients are kept per server, for at most
+		idle_timeout seconds each. Servers ping idle connections, so they stay open meanwhile."""
+
+		self.size = size
+		self.idle_timeout = idle_timeout
+		self.idle = {} #(ip address, port) to a list of (client, when it was released), oldest first
+		self.lock = threading.Lock()
+
+
+	def acquire(self, ip_address, port, calling_method, on_disconnect=None):
+		"""Returns a client connected to the server, reusing an idle one if there is any. Raises the errors of
+		connect_to_server if a new one can't connect."""
+
+		while True:
+			with self.lock:
+				stale = self.prune()
+				idle = self.idle.get((ip_address, port))
+				client = idle.pop()[0] if idle else None
+
+			for old in stale:
+				old.close(0)
+
+			if client is None:
+				break
+
+			client.attach(calling_method, on_disconnect)
+
+			if client.state == "open": #It may have been lost just before it was attached
+				return client
+
+		client = PlayerClient(ip_address, port, calling_method, on_disconnect)
+		client.connect_to_server()
+
+		return client
+
+
+	def release(self, client):
+		"""Takes the client out of its game and keeps it for the next one on the same server, or closes it if
+		there are enough idle clients already."""
+
+		if client.state != "open":
+			client.close(0)
+			return
+
+		client.attach(None, lambda: self.discard(client))
+		client.leave()
+
+		with self.lock:
+			stale = self.prune()
+			idle = self.idle.setdefault((client.ip_address, client.port), [])
+			idle.append((client, time.monotonic()))
+			excess = max(0, len(idle) - self.size)
+			stale += [old for old, _ in idle[:excess]]
+			del idle[:excess]
+
+		for old in stale:
+			old.close(0)
+
+
+	def discard(self, client):
+		"""Forgets an idle client whose connection was lost."""
+
+		with self.lock:
+			idle = self.idle.get((client.ip_address, client.port), [])
+			idle[:] = [(other, released) for other, released in idle if other is not client]
+
+
+	def prune(self):
+		"""Takes out the clients that were idle for too long and returns them, to be closed outside the lock."""
+
+		deadline = time.monotonic() - self.idle_timeout
+		stale = []
+
+		for idle in self.idle.values():
+			stale += [client for client, released in idle if released < deadline]
+			idle[:] = [(client, released) for client, released in idle if released >= deadline]
+
+		return stale
+
+
+	def close(self, timeout=1):
+		"""Closes every idle client, letting their LEAVE go out first."""
+
+		with self.lock:
+			clients = [client for idle in self.idle.values() for client, _ in idle]
+			self.idle.clear()
+
+		for client in clients:
+			client.close(timeout)
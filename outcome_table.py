@@ -0,0 +1,220 @@
+"""Precomputed outcome of every 3x3 position. The table holds one byte per position, indexed by the base 3
+number of the board (cell i is worth 3**i for an X and 2 * 3**i for an O), so a lookup is a couple of list
+reads and one byte read from a memory mapped file. Each byte packs:
+
+	bits 0-3: best move for the player to move (NO_MOVE if the game is over)
+	bits 4-5: status of the position (ONGOING, X_WON, O_WON or DRAWN)
+	bits 6-7: value for the player to move with perfect play (DRAWING, WINNING or LOSING)
+
+Positions that can't come up in a game hold INVALID. The table is generated once with
+'python outcome_table.py' and loaded lazily the first time it is needed. Positions are solved once per
+class of the 8 board symmetries, and the result is spread to every member of the class."""
+
+import mmap
+import os
+
+from engine import CELLS, FULL, X, O, is_win, cells
+
+
+
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "res", "outcomes.bin")
+MAGIC = b"TTQO\x00\x00\x00\x01" #File signature followed by the format version
+SIZE = 3 ** CELLS
+
+#Status of a position
+ONGOING = 0
+X_WON = 1
+O_WON = 2
+DRAWN = 3
+
+#Value for the player to move
+DRAWING = 0
+WINNING = 1
+LOSING = 2
+
+NO_MOVE = 15
+INVALID = 0xFF
+
+#Base 3 weight of every X position. O positions weigh twice as much. Each entry is built from the entry
+#without its lowest cell.
+BASE3 = [0] * (FULL + 1)
+
+for _mask in range(1, FULL + 1):
+	_low = _mask & -_mask
+	BASE3[_mask] = BASE3[_mask ^ _low] + 3 ** (_low.bit_length() - 1)
+
+#The 8 symmetries of the board, as the cell each cell is sent to.
+SYMMETRIES = (
+	(0, 1, 2, 3, 4, 5, 6, 7, 8), #Identity
+	(6, 3, 0, 7, 4, 1, 8, 5, 2), #Rotations
+	(8, 7, 6, 5, 4, 3, 2, 1, 0),
+	(2, 5, 8, 1, 4, 7, 0, 3, 6),
+	(2, 1, 0, 5, 4, 3, 8, 7, 6), #Reflections
+	(6, 7, 8, 3, 4, 5, 0, 1, 2),
+	(0, 3, 6, 1, 4, 7, 2, 5, 8),
+	(8, 5, 2, 7, 4, 1, 6, 3, 0)
+)
+
+_table = None
+
+
+
+def state_index(x_mask, o_mask):
+	"""Base 3 index of the position."""
+
+	return BASE3[x_mask] + 2 * BASE3[o_mask]
+
+
+def transform(mask, symmetry):
+	"""Moves every cell of mask to where the symmetry sends it."""
+
+	result = 0
+
+	for index in cells(mask):
+		result |= 1 << symmetry[index]
+
+	return result
+
+
+def canonical(x_mask, o_mask):
+	"""Returns the smallest index among the 8 symmetric versions of the position, and the symmetry that
+	produces it. Positions with the same canonical index have the same outcome."""
+
+	return min((state_index(transform(x_mask, symmetry), transform(o_mask, symmetry)), number)
+		for number, symmetry in enumerate(SYMMETRIES))
+
+
+def load(path=TABLE_PATH):
+	"""Memory maps the table, building it first if the file doesn't exist yet."""
+
+	global _table
+
+	if not os.path.exists(path):
+		build(path)
+
+	with open(path, "rb") as file:
+		table = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+	if table[:len(MAGIC)] != MAGIC or len(table) != len(MAGIC) + SIZE:
+		table.close()
+		raise ValueError(f"{path} isn't an outcome table this version can read")
+
+	_table = table
+	return table
+
+
+def lookup(x_mask, o_mask):
+	"""Returns the byte stored for the position."""
+
+	table = _table if _table is not None else load()
+
+	return table[len(MAGIC) + BASE3[x_mask] + 2 * BASE3[o_mask]]
+
+
+def status(x_mask, o_mask):
+
+	return lookup(x_mask, o_mask) >> 4 & 3
+
+
+def value(x_mask, o_mask):
+
+	return lookup(x_mask, o_mask) >> 6
+
+
+def best_move(x_mask, o_mask):
+	"""Index of the best cell to play, or None if the game is over."""
+
+	move = lookup(x_mask, o_mask) & 15
+
+	return None if move == NO_MOVE else move
+
+
+
+def x_to_move(x_mask, o_mask):
+
+	return bin(x_mask).count("1") == bin(o_mask).count("1")
+
+
+def scored_moves(x_mask, o_mask, solved):
+	"""Yields every move of an ongoing position as (index, position after the move, score). The score is
+	positive if the move wins for the player making it, negative if it loses, zero for a draw. Quicker wins
+	and slower losses score higher."""
+
+	x_turn = x_to_move(x_mask, o_mask)
+	free = FULL & ~(x_mask | o_mask)
+
+	for index in cells(free):
+
+		child = (x_mask | 1 << index, o_mask) if x_turn else (x_mask, o_mask | 1 << index)
+
+		if is_win(child[X] if x_turn else child[O], index):
+			score = 10
+		elif free == 1 << index:
+			score = 0
+		else:
+			score = -solve(*child, solved)
+			score -= (score > 0) - (score < 0) #Results farther away count a little less
+
+		yield index, child, score
+
+
+def solve(x_mask, o_mask, solved):
+	"""Negamax over the whole game tree, for an ongoing position. Scores are saved in solved by canonical
+	index, so symmetric positions are only searched once."""
+
+	key = canonical(x_mask, o_mask)[0]
+
+	if key not in solved:
+		solved[key] = max(score for _, _, score in scored_moves(x_mask, o_mask, solved))
+
+	return solved[key]
+
+
+def build(path=TABLE_PATH):
+	"""Generates the table by walking every position reachable from the empty board, and writes it to path."""
+
+	table = bytearray([INVALID]) * SIZE
+	solved = {}
+	pending = [(0, 0)]
+	seen = {0}
+
+	while pending:
+
+		x_mask, o_mask = pending.pop()
+		index = state_index(x_mask, o_mask)
+		x_turn = x_to_move(x_mask, o_mask)
+		last_mask = o_mask if x_turn else x_mask #Position of whoever moved last
+
+		if any(is_win(last_mask, cell) for cell in cells(last_mask)):
+			table[index] = (O_WON if x_turn else X_WON) << 4 | NO_MOVE
+			continue
+
+		if x_mask | o_mask == FULL:
+			table[index] = DRAWN << 4 | NO_MOVE
+			continue
+
+		chosen, best_score = None, None
+
+		for move, child, score in scored_moves(x_mask, o_mask, solved):
+
+			if best_score is None or score > best_score:
+				chosen, best_score = move, score
+
+			child_index = state_index(*child)
+			if child_index not in seen:
+				seen.add(child_index)
+				pending.append(child)
+
+		result = WINNING if best_score > 0 else LOSING if best_score < 0 else DRAWING
+		table[index] = result << 6 | ONGOING << 4 | chosen
+
+	with open(path, "wb") as file:
+		file.write(MAGIC)
+		file.write(table)
+
+
+
+if __name__ == "__main__":
+
+	build()
+	print(f"Outcome table written to {TABLE_PATH}")
\ No newline at end of file
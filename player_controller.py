@@ -1,40 +1,42 @@
-from dataclasses import make_dataclass
 import socket
 import threading
-from networking import PlayerClient
+import time
+from protocol import CREATE, PLAYED, REJECTED, CLOSING, RESUMED, CAPABILITIES, CAP_RESUME, encode_hello, encode_played
+from engine import Board, IllegalMove, X, O, ONGOING, WIN, DRAW, cells
+import outcome_table
+import metrics
+from ui_events import EventQueue
 
 
 
-Cell = make_dataclass("Cell", ("index", "token"))
+MOVE_RTT = metrics.histogram("ttq_move_rtt_seconds", "Time from sending a move to the server relaying it back")
+DISPATCH_TIME = metrics.histogram("ttq_dispatch_seconds", "Time react_to_messages took to handle a message")
 
 
 
 class PlayerController:
 
-	def __init__(self, player_model, player_frame):
+	def __init__(self, player_model, player_frame, pool):
+		"""The connection to the server is taken from pool, a networking.ConnectionPool, and given back to it
+		once the player leaves the game."""
 
 		self.player_model = player_model
+		self.pool = pool
 		self.player_frame = player_frame
 		self.player_frame.controller = self
+		self.move_sent_at = None #When the player's last move was sent, until the server relays it back
 
-		#These are the cell combination where each cell would be involved in for a victory.
-		self.cell_combinations = {
-			0: ((0,1,2), (0,3,6), (0,4,8)),
-			1: ((0,1,2), (1,4,7)),
-			2: ((0,1,2), (2,5,8), (6,4,2)),
-			3: ((0,3,6), (3,4,5)),
-			4: ((3,4,5), (1,4,7), (0,4,8), (6,4,2)),
-			5: ((3,4,5), (2,5,8)),
-			6: ((0,3,6), (6,7,8), (6,4,2)),
-			7: ((6,7,8), (1,4,7)),
-			8: ((6,7,8), (0,4,8), (2,5,8)),
-		}
+		#Messages arrive on the client's thread, but widgets may only be touched from the Tk thread
+		self.events = EventQueue(player_frame)
+		self.events.start()
 
+		#Handlers for the messages the server may send, by message type.
 		self.possible_messages = {
-			"NAME": None,
-			"CREATE": None,
-			"PLAYED": None,
-			"CLOSING": None
+			CREATE: self.received_CREATE,
+			PLAYED: self.received_PLAYED,
+			REJECTED: self.received_REJECTED,
+			CLOSING: self.received_CLOSING,
+			RESUMED: self.received_RESUMED
 		}
 
 		self.create_client()
@@ -43,99 +45,98 @@ class PlayerController:
 	def create_client(self):
 
 		try:
-			self.player_client = PlayerClient(self.player_model.ip_address, self.player_model.port, self.react_to_messages)
-			self.player_client.connect_to_server()
+			self.player_client = self.pool.acquire(self.player_model.ip_address, self.player_model.port,
+				lambda message: self.events.post(self.react_to_messages, message), lambda: self.events.post(self.connection_lost))
+			self.player_client.send_message(encode_hello(self.player_model.player.name, CAPABILITIES | CAP_RESUME))
 		except Exception as e:
 			self.player_frame.display_connection_error(e, (self.player_model.ip_address, self.player_model.port))
 		else:
 			self.player_frame.display_connection_accepted((self.player_model.ip_address, self.player_model.port))
 
 
-	def react_to_messages(self, message):
+	def close(self):
+		"""Stops reacting to the server and leaves the game, which tells the rival. The connection goes back to
+		the pool for the next game."""
 
-		if message == "NAME": #Server is requesting player's name
-			self.received_NAME()
+		self.events.stop()
 
-		elif message[:6] == "CREATE": #Server instructs to create a new game
-			self.received_CREATE(message)
+		if hasattr(self, "player_client"):
+			self.pool.release(self.player_client)
 
-		elif message[:6] == "PLAYED":
-			self.received_PLAYED(message)
 
-		elif message == "CLOSING":
-			self.received_CLOSING()
+	def react_to_messages(self, message):
+		"""Message is a tuple of the message type followed by its fields, as decoded by the protocol module.
+		Runs on the Tk thread, in a batch drained by the event queue."""
 
-		else:
-			pass
+		started = time.perf_counter()
+		handler = self.possible_messages.get(message[0])
 
+		if handler is not None:
+			handler(*message[1:])
 
-	def check_for_win(self, index):
-		"""Checks if last move is a winning move."""
+		DISPATCH_TIME.time(started)
 
-		possible_comb = self.cell_combinations[index]
 
-		for comb in possible_comb:
+	def send_move(self, index):
 
-			tokens = []
-			tokens.append(self.player_model.grid[comb[0]].token)
-			tokens.append(self.player_model.grid[comb[1]].token)
-			tokens.append(self.player_model.grid[comb[2]].token)
+		self.move_sent_at = time.perf_counter()
+		self.player_client.send_message(encode_played(index))
 
-			if all([token == self.player_model.current_player.token for token in tokens]):
 
-				return True
+	def check_for_win(self, index):
+		"""Checks if last move is a winning move. Classic games are looked up in the outcome table, bigger
+		boards were checked by the board itself when the move was played."""
+
+		board = self.player_model.board
+
+		if not board.is_standard():
+			return board.result == WIN
 
-		return False
+		return outcome_table.status(board.masks[X], board.masks[O]) in (outcome_table.X_WON, outcome_table.O_WON)
 
 	
 	def check_for_tie(self):
-		"""Checks if there is any available cell."""
+		"""Checks if the board filled up without a winner."""
 
-		if len(self.player_model.available_cells) > 0:
-			return False
-		else:
-			return True
+		board = self.player_model.board
 
+		if not board.is_standard():
+			return board.result == DRAW
 
-	def create_game(self):
-		"""Gives player frame instructions to create the game."""
+		return outcome_table.status(board.masks[X], board.masks[O]) == outcome_table.DRAWN
 
-		self.player_model.grid = []
-		self.player_model.available_cells = []
 
-		for i in range(9):
-			c = Cell(i, None)
-			self.player_model.grid.append(c)
-			self.player_model.available_cells.append(c)
+	def available_cells(self):
+		"""Indices of the cells that can still be played."""
 
-		self.player_frame.setup_game(self.player_model.current_player.name)
+		return cells(self.player_model.board.legal)
+
+
+	def create_game(self, size=3, win_length=3):
+		"""Gives player frame instructions to create the game."""
+
+		self.player_model.board = Board(size, win_length)
+
+		self.player_frame.setup_game(self.player_model.current_player.name, size)
 
 
 	def play(self):
 		"""Sets app for the player to make a move."""
 
 		self.player_model.current_player = self.player_model.player
-		self.player_frame.prepare_to_play(self.player_model.available_cells)
+		self.events.redraw("turn", self.player_frame.prepare_to_play, list(self.available_cells()))
 
 
 	def wait_to_play(self):
 		"""Sets the app for the player to wait its turn."""
 
 		self.player_model.current_player = self.player_model.rival_player
-		self.player_frame.prepare_to_wait_turn(self.player_model.rival_player.name, self.player_model.available_cells)
+		self.events.redraw("turn", self.player_frame.prepare_to_wait_turn, self.player_model.rival_player.name, list(self.available_cells()))
 
 
-	def received_NAME(self, message=None):
-		"""Called when server asks NAME"""
-
-		self.player_client.send_message(self.player_model.player.name)
-
-
-	def received_CREATE(self, message):
+	def received_CREATE(self, rival_name, order, size, win_length):
 		"""Called when server says to CREATE"""
 
-		_, rival_name, order = message.split(' ')
-
 		player_token = "X" if order == "first" else "O"
 		rival_token = "O" if order == "first" else "X"
 
@@ -146,7 +147,7 @@ class PlayerController:
 		self.player_model.rival_player.token = rival_token
 		self.player_model.current_player = self.player_model.player if order == "first" else self.player_model.rival_player
 
-		self.create_game()
+		self.create_game(size, win_length)
 
 		if order == "first":
 			self.play()
@@ -157,16 +158,22 @@ class PlayerController:
 		self.player_frame.message_screen.write(f"New game against {rival_name}")
 		self.player_frame.message_screen.write(f"You go {order}")
 
+		if size != 3 or win_length != 3:
+			self.player_frame.message_screen.write(f"Board is {size}x{size}, {win_length} in a row wins")
 
-	def received_PLAYED(self, message):
+
+	def received_PLAYED(self, index):
 		"""Called when client receives a PLAYED message."""
 
-		_, index = message.split(' ')
-		index = int(index)
+		if self.move_sent_at is not None and self.player_model.current_player == self.player_model.player:
+			MOVE_RTT.time(self.move_sent_at)
+			self.move_sent_at = None
 
-		played_cell = self.player_model.grid[index]
-		self.player_model.available_cells.remove(played_cell)
-		played_cell.token = self.player_model.current_player.token
+		try:
+			self.player_model.board.play(index)
+		except IllegalMove: #Server relayed a move that doesn't fit this game, so it's ignored
+			self.player_frame.message_screen.write("Ignored a move that doesn't fit this game")
+			return
 
 		self.player_frame.player_played(index, self.player_model.current_player.token)
 
@@ -181,7 +188,7 @@ class PlayerController:
 				header = "Game Over"
 				message = "You lost"
 
-			self.player_frame.game_over(header, message, self.player_model.available_cells)
+			self.events.redraw("game_over", self.player_frame.game_over, header, message, list(self.available_cells()))
 			self.player_frame.message_screen.write(message)
 			
 		else:
@@ -190,7 +197,7 @@ class PlayerController:
 			if tied:
 				header = "Tied Game"
 				message = "At least you didn't lose"
-				self.player_frame.game_over(header, message, [])
+				self.events.redraw("game_over", self.player_frame.game_over, header, message, [])
 				self.player_frame.message_screen.write("You tied the game")
 			else:
 				if self.player_model.player == self.player_model.current_player:
@@ -199,8 +206,49 @@ class PlayerController:
 					self.play()
 
 
+	def received_REJECTED(self, index):
+		"""Called when the server refuses a move, which can happen if the player clicked while a move was
+		still on its way. The board is left as it was."""
+
+		self.move_sent_at = None
+		self.player_frame.notify_move_rejected(index)
+
+
+	def received_RESUMED(self, game, rival_name, order, size, win_length, first, moves):
+		"""Called when the client got its seat back after its connection dropped. If the game is the one on the
+		board, only the moves missed are played on it. Otherwise the game is set up again from its moves."""
+
+		board = self.player_model.board
+		token = "X" if order == "first" else "O"
+		same_game = (board is not None and (board.geometry.size, board.geometry.win_length) == (size, win_length)
+			and self.player_model.player.token == token and (board.masks[X] | board.masks[O]).bit_count() == first)
+
+		self.move_sent_at = None #A move sent while the connection was down was lost, and is played again
+
+		if not same_game:
+			self.received_CREATE(rival_name, order, size, win_length)
+
+		for index in moves:
+			self.received_PLAYED(index)
+
+		if self.player_model.board.result == ONGOING: #Turn is set up again, since a lost move left it waiting
+			if self.player_model.current_player == self.player_model.player:
+				self.play()
+			else:
+				self.wait_to_play()
+
+		self.player_frame.message_screen.write("Reconnected to the game")
+
+
 	def received_CLOSING(self):
 		"""Called when received CLOSING message"""
 
 		self.player_frame.notify_rival_closing()
-		self.player_frame.master.go_to_previous_screen(False)
\ No newline at end of file
+		self.player_frame.master.go_to_previous_screen()
+
+
+	def connection_lost(self):
+		"""Called when the connection to the server drops without the player leaving."""
+
+		self.player_frame.notify_connection_lost()
+		self.player_frame.master.go_to_previous_screen()
\ No newline at end of file
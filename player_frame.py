@@ -1,10 +1,11 @@
 import tkinter as tk
 import tkinter.messagebox as msgbox
-from pathlib import Path
 import os
 
+import resources
 from messagescreen import MessageScreen
-from styles import BACKGROUND_SCREEN, BACKGROUND_BUTTON, FOREGROUND_LABEL, FOREGROUND_BUTTON
+from protocol import RESTART_FRAME
+from styles import BACKGROUND_SCREEN, BACKGROUND_BUTTON, FOREGROUND_LABEL, FOREGROUND_BUTTON, BACKGROUND_CELL, BACKGROUND_CELL_ACTIVE
 
 
 
@@ -66,59 +67,45 @@ class PlayerFrame(tk.Frame):
 		self.restart_button.configure(state="disabled", command=self.on_restart)
 		self.restart_button.pack(pady=(10,10), padx=(10,10))
 
-		self.message_screen = MessageScreen(self)
+		self.message_screen = MessageScreen(self, history=os.environ.get("TTQ_MESSAGE_LOG")) #Keeps every message on disk if set
 		self.message_screen.pack(pady=(5,5), padx=(5,5))
 
 
 	def load_images(self):
 		"""Loads images used in the game grid cells."""
 
-		self.X_IMAGE = tk.PhotoImage(file=Path(os.getcwd(), 'res', 'X.png'))
-		self.O_IMAGE = tk.PhotoImage(file=Path(os.getcwd(), 'res', 'O.png'))
-		self.BLANK_IMAGE = tk.PhotoImage(file=Path(os.getcwd(), 'res', 'blank.png'))
+		self.X_IMAGE = resources.image("X.png")
+		self.O_IMAGE = resources.image("O.png")
 
 
-	def setup_grid(self):
-		"""Sets up the game grid."""
+	def setup_grid(self, size=3):
+		"""Sets up a size x size game grid, replacing the previous one if there is any."""
 
-		self.grid = []
+		if hasattr(self, "board"):
+			self.board.destroy()
 
-		self.first_grid_row = CellRow(self)
-		self.second_grid_row = CellRow(self)
-		self.third_grid_row = CellRow(self)
+		self.board = BoardCanvas(self, size, self.on_cell_pressed, {"X": self.X_IMAGE, "O": self.O_IMAGE})
 
-		for i in range(9):
+		if hasattr(self, "restart_button"): #Grid is being replaced, so it goes back above the button
+			self.board.pack(before=self.restart_button, pady=(0,5))
+		else:
+			self.board.pack(pady=(0,5))
 
-			if i in (0,1,2):
-				row = self.first_grid_row
-			elif i in (3,4,5):
-				row = self.second_grid_row
-			else:
-				row = self.third_grid_row
 
-			cell = CellButton(row, i, image=self.BLANK_IMAGE, state="disabled")
-			self.grid.append(cell)
-			cell.pack(side=tk.LEFT)
-		
-		self.first_grid_row.pack()
-		self.second_grid_row.pack()
-		self.third_grid_row.pack()
-
-
-	def setup_game(self, current_player_name):
+	def setup_game(self, current_player_name, size=3):
 		"""Sets all necessary things to start a game."""
 
-		for c in self.grid:
-			c.configure(image=self.BLANK_IMAGE, state="disabled", token=None)
+		if size != self.board.size:
+			self.setup_grid(size)
+		else:
+			self.board.clear()
 
 
 	def prepare_to_play(self, available_cells):
-		"""Makes the available cell clickable for the player."""
+		"""Makes the available cells clickable for the player. Available_cells are cell indices."""
 
 		self.current_player_label.configure(text="It's your turn.")
-
-		for cell in available_cells:
-			self.grid[cell.index].configure(state="normal")
+		self.board.set_enabled(available_cells, True)
 
 		self.restart_button.configure(state="normal")
 
@@ -127,9 +114,7 @@ class PlayerFrame(tk.Frame):
 		"""Disables all cells in the grid as well as the restart button."""
 
 		self.current_player_label.configure(text=f"It's {rival_name}'s turn")
-
-		for cell in available_cells:
-			self.grid[cell.index].configure(state="disabled")
+		self.board.set_enabled(available_cells, False)
 
 		self.restart_button.configure(state="disabled")
 
@@ -137,17 +122,13 @@ class PlayerFrame(tk.Frame):
 	def player_played(self, index, token):
 		"""Updates the game screen after a play."""
 
-		self.grid[index].token = token
-		image = self.X_IMAGE if token == 'X' else self.O_IMAGE
-		self.grid[index].configure(image=image, state="disabled")
+		self.board.set_token(index, token)
 
 
 	def game_over(self, header, message, available_cells):
 		"""Display some message to the user once the game is over."""
 
-		for cell in available_cells:
-
-			self.grid[cell.index].configure(state="disabled")
+		self.board.set_enabled(available_cells, False)
 
 		msgbox.showinfo(header, message)
 
@@ -159,38 +140,124 @@ class PlayerFrame(tk.Frame):
 		msgbox.showinfo("Last Man Standing", "Rival left the game")
 
 
-	def on_cell_pressed(self, cell):
-		"""Receives the instance of the cell that was pressed."""
+	def notify_move_rejected(self, index):
+		"""Method called when the server refuses a move the player sent."""
+
+		self.message_screen.write(f"The server refused your move on cell {index}")
+
+
+	def notify_connection_lost(self):
+		"""Method called when the connection to the server is lost in the middle of a game."""
+
+		if hasattr(self, "message_screen"):
+			self.message_screen.write("Lost connection to the server")
+		msgbox.showinfo("Connection lost", "The connection to the server was lost")
 
-		self.controller.player_client.send_message(f"PLAYED {cell.index}")
+
+	def on_cell_pressed(self, index):
+		"""Receives the index of the cell that was pressed."""
+
+		self.controller.send_move(index)
 
 	
 	def on_restart(self):
 		"""Method called when the restart button is pressed."""
 
-		self.controller.player_client.send_message("RESTART")
+		self.controller.player_client.send_message(RESTART_FRAME)
 		self.message_screen.write("You restarted the game")
 
 
 
-class CellRow(tk.Frame):
+class BoardCanvas(tk.Canvas):
 
-	def __init__(self, master, **kwargs):
+	CELL_SIZE = 41 #Pixels, for boards small enough. Bigger boards shrink their cells to fit in MAX_SIDE
+	MAX_SIDE = 492
+	GAP = 2
 
-		super().__init__(master, **kwargs)
 
+	def __init__(self, master, size, on_cell_pressed, images, **kwargs):
+		"""The whole size x size grid is one canvas, with a rectangle per cell and a token drawn over it once
+		the cell is played. Clicks are turned into a cell index from their coordinates and passed to
+		on_cell_pressed, if the cell is enabled. Only cells whose token or state changes are redrawn, so a
+		turn costs the same on a 15x15 board as on a 3x3 one. Images maps 'X' and 'O' to the token images,
+		used when cells are big enough for them; smaller cells get a letter."""
 
+		self.size = size
+		self.cell = min(self.CELL_SIZE, self.MAX_SIDE // size)
+		side = self.cell * size + self.GAP
 
-class CellButton(tk.Button):
+		super().__init__(master, width=side, height=side, bg=BACKGROUND_SCREEN, highlightthickness=0, **kwargs)
 
-	def __init__(self, master, index, **kwargs):
-		"""The command is set in the cell's constructor, since each button will call a method from the master
-		widget passing its reference as an argument. This assignment can't be done in the master widget inside
-		a loop, since all buttons seem to call the method giving the reference of the last cell."""
+		self.on_cell_pressed = on_cell_pressed
+		self.images = images if self.cell >= max(image.width() for image in images.values()) + self.GAP else None
+		self.tokens = [None] * (size * size)
+		self.enabled = [False] * (size * size)
+		self.token_items = [None] * (size * size)
+		self.cell_items = [
+			self.create_rectangle(*self.bounds(index), fill=BACKGROUND_CELL, outline="")
+			for index in range(size * size)
+		]
 
-		super().__init__(master, **kwargs)
-		#The cells master is a frame, and the frame's master is the screen tha tcontains the method.
-		self.configure(command=lambda: self.master.master.on_cell_pressed(self))
+		self.bind("<Button-1>", self.on_click)
+
+
+	def bounds(self, index):
+		"""Corners of the cell, leaving a gap between cells."""
+
+		row, column = divmod(index, self.size)
+		x, y = column * self.cell + self.GAP, row * self.cell + self.GAP
+
+		return x, y, x + self.cell - self.GAP, y + self.cell - self.GAP
+
+
+	def on_click(self, event):
+
+		column, row = event.x // self.cell, event.y // self.cell
+
+		if 0 <= column < self.size and 0 <= row < self.size:
+			index = row * self.size + column
+			if self.enabled[index]:
+				self.on_cell_pressed(index)
+
+
+	def set_enabled(self, indices, enabled):
+		"""Lets the player click the given cells, or stops letting them."""
+
+		for index in indices:
+			if self.enabled[index] != enabled:
+				self.enabled[index] = enabled
+				self.itemconfigure(self.cell_items[index], fill=BACKGROUND_CELL_ACTIVE if enabled else BACKGROUND_CELL)
+
+
+	def set_token(self, index, token):
+		"""Draws token ('X', 'O' or None) on the cell, which can't be clicked any more."""
+
+		self.set_enabled((index,), False)
+
+		if self.tokens[index] == token:
+			return
+
+		self.tokens[index] = token
+
+		if self.token_items[index] is not None:
+			self.delete(self.token_items[index])
+			self.token_items[index] = None
+
+		if token is None:
+			return
+
+		x1, y1, x2, y2 = self.bounds(index)
+		center = ((x1 + x2) // 2, (y1 + y2) // 2)
+
+		if self.images is not None:
+			self.token_items[index] = self.create_image(*center, image=self.images[token])
+		else:
+			self.token_items[index] = self.create_text(*center, text=token, fill=FOREGROUND_LABEL if token == "X" else FOREGROUND_BUTTON,
+				font=("TkDefaultFont", max(6, self.cell // 2), "bold"))
+
+
+	def clear(self):
+		"""Empties the board and disables every cell, for a new game."""
 
-		self.index = index
-		self.token = None
\ No newline at end of file
+		for index in range(self.size * self.size):
+			self.set_token(index, None)
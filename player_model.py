@@ -14,5 +14,4 @@ class PlayerModel:
 		self.port = port
 		self.mode = mode
 		self.current_player = None
-		self.grid = []
-		self.available_cells = []
\ No newline at end of file
+		self.board = None #engine.Board of the game being played
\ No newline at end of file
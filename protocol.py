@@ -0,0 +1,330 @@
+"""Wire protocol shared by the server and the player clients. Every message travels in a frame made of a small
+header (protocol version, message type, channel and payload length) followed by a struct packed payload, so
+messages can be told apart no matter how TCP splits or joins them, and several of them can be sent in a single
+write. The channel lets one connection play many games at once: each game is played on a channel of its own,
+and every message about it carries that channel. Clients that play one game use channel 0."""
+
+import struct
+
+
+
+VERSION = 8
+
+#Message types. Type 1 was NAME, the server asking for the player's name, which HELLO replaced in version 3.
+CREATE = 2
+PLAYED = 3
+RESTART = 4
+CLOSING = 5
+PING = 6 #Heartbeat, answered with PONG by whoever receives it
+PONG = 7
+HELLO = 8 #First frame a client sends: its name, capabilities, preferred board and rating
+REJECTED = 9 #Server refused a move that was out of turn or on a cell that can't be played
+WATCH = 10 #First frame a spectator sends instead of HELLO: the room it wants to watch
+WATCHING = 11 #Board of the watched room, sent to spectators when they join, when a game starts and when they catch up
+LEAVE = 12 #Player leaves its room, or the lobby, but keeps the connection to send HELLO again. Echoed by the server once done
+SESSION = 13 #Token a player can resume its seat with if its connection drops, sent after CREATE to players that can resume
+RESUME = 14 #First frame of a player reconnecting instead of HELLO: its token and the moves of its game it has seen
+RESUMED = 15 #Answer to RESUME: the game the player is back in and the moves it missed, or all of them if it missed a new game
+
+NAMES = {CREATE: "CREATE", PLAYED: "PLAYED", RESTART: "RESTART", CLOSING: "CLOSING", PING: "PING", PONG: "PONG", HELLO: "HELLO",
+	REJECTED: "REJECTED", WATCH: "WATCH", WATCHING: "WATCHING", LEAVE: "LEAVE", SESSION: "SESSION", RESUME: "RESUME",
+	RESUMED: "RESUMED"} #Message type to name, for logs and metrics
+
+#Capabilities a client announces in HELLO
+CAP_HEARTBEAT = 1 #Answers PING
+CAP_VARIANTS = 2 #Can play boards other than 3x3
+CAP_RESUME = 4 #Reconnects with RESUME when its connection drops, so its seat is kept for a while
+CAPABILITIES = CAP_HEARTBEAT | CAP_VARIANTS #Every client answers PING and plays any board. Resuming takes more, so it is opt in
+
+ORDERS = ("first", "second")
+
+HEADER = struct.Struct("!BBHH") #version, message type, channel, payload length
+CHANNEL = struct.Struct("!H") #Channel in the header, right after the version and the type
+CREATE_PAYLOAD = struct.Struct("!BBB") #order, board size and cells in a row to win, followed by the rival's name
+PLAYED_PAYLOAD = struct.Struct("!H") #cell index, also used by REJECTED
+HELLO_PAYLOAD = struct.Struct("!HBBH") #capabilities, preferred board size and win length (0 for any), rating (0 for unrated), followed by the name
+WATCH_PAYLOAD = struct.Struct("!I") #room id
+WATCHING_PAYLOAD = struct.Struct("!BBBBHH") #board size, win length, length of X's and O's names, number of X and O cells,
+											#followed by both names and the cells of X and then O, two bytes each
+SESSION_PAYLOAD = struct.Struct("!I") #game number in the room, followed by the token
+RESUME_PAYLOAD = struct.Struct("!IH") #game number and moves seen of it, followed by the token
+RESUMED_PAYLOAD = struct.Struct("!IBBBHH") #game number, order, board size, win length, index of the first move sent and number
+											#of moves, followed by the moves, two bytes each, and the rival's name
+
+MAX_PAYLOAD = 0xFFFF
+MAX_CHANNEL = 0xFFFF
+
+
+
+class ProtocolError(Exception):
+	"""Raised when a peer sends something that isn't a valid frame."""
+	pass
+
+
+
+def encode(kind, payload=b"", channel=0):
+	"""Builds the frame for a message of the given type."""
+
+	if len(payload) > MAX_PAYLOAD:
+		raise ProtocolError(f"Payload of {len(payload)} bytes doesn't fit in a frame")
+
+	return HEADER.pack(VERSION, kind, channel, len(payload)) + payload
+
+
+def on_channel(frame, channel):
+	"""Returns the frame, or run of frames, with every header set to the given channel. Frames are encoded
+	for channel 0, and most are built once and reused, so this is how they reach the other channels."""
+
+	frame = bytearray(frame)
+	offset = 0
+
+	while offset < len(frame):
+		CHANNEL.pack_into(frame, offset + 2, channel)
+		offset += HEADER.size + HEADER.unpack_from(frame, offset)[3]
+
+	return bytes(frame)
+
+
+def encode_hello(name, capabilities=CAPABILITIES, size=0, win_length=0, rating=0):
+	"""Frame a client opens the connection with, so the server can queue it without asking anything."""
+
+	return encode(HELLO, HELLO_PAYLOAD.pack(capabilities, size, win_length, rating) + name.encode("utf-8"))
+
+
+def encode_create(rival_name, order, size=3, win_length=3):
+	"""Frame telling a player who the rival is, whether it goes 'first' or 'second', and the board to play on."""
+
+	return encode(CREATE, CREATE_PAYLOAD.pack(ORDERS.index(order), size, win_length) + rival_name.encode("utf-8"))
+
+
+def encode_played(index):
+	"""Frame for a move. Frames are built once per cell and reused afterwards."""
+
+	frame = _played_frames.get(index)
+
+	if frame is None:
+		frame = _played_frames[index] = encode(PLAYED, PLAYED_PAYLOAD.pack(index))
+
+	return frame
+
+
+def encode_watch(room_id):
+	"""Frame a spectator opens the connection with."""
+
+	return encode(WATCH, WATCH_PAYLOAD.pack(room_id))
+
+
+def encode_watching(x_name, o_name, size, win_length, x_cells, o_cells):
+	"""Frame with everything a spectator needs to draw the board: who plays X and O, the board and the cells
+	each player holds."""
+
+	x_name, o_name = x_name.encode("utf-8"), o_name.encode("utf-8")
+	x_cells, o_cells = list(x_cells), list(o_cells)
+	cells = x_cells + o_cells
+	header = WATCHING_PAYLOAD.pack(size, win_length, len(x_name), len(o_name), len(x_cells), len(o_cells))
+
+	return encode(WATCHING, header + x_name + o_name + struct.pack(f"!{len(cells)}H", *cells))
+
+
+def encode_rejected(index):
+	"""Frame telling a player that its move on the cell at index was refused."""
+
+	return encode(REJECTED, PLAYED_PAYLOAD.pack(index))
+
+
+def encode_session(token, game):
+	"""Frame giving a player the token to resume its seat with, for the given game of its room."""
+
+	return encode(SESSION, SESSION_PAYLOAD.pack(game) + token)
+
+
+def encode_resume(token, game, seen):
+	"""Frame a player reconnects with, saying how many moves of the given game it has seen."""
+
+	return encode(RESUME, RESUME_PAYLOAD.pack(game, seen) + token)
+
+
+def encode_resumed(game, rival_name, order, size, win_length, first, moves):
+	"""Frame putting a reconnected player back in its game: the moves of it from the first index on, which
+	are only the ones it missed if it was still in the same game, and the rest of what CREATE tells."""
+
+	moves = list(moves)
+	header = RESUMED_PAYLOAD.pack(game, ORDERS.index(order), size, win_length, first, len(moves))
+
+	return encode(RESUMED, header + struct.pack(f"!{len(moves)}H", *moves) + rival_name.encode("utf-8"))
+
+
+_played_frames = {}
+
+RESTART_FRAME = encode(RESTART)
+CLOSING_FRAME = encode(CLOSING)
+PING_FRAME = encode(PING)
+PONG_FRAME = encode(PONG)
+LEAVE_FRAME = encode(LEAVE)
+
+
+
+def decode(kind, buffer, offset, length):
+	"""Turns the payload found at buffer[offset:offset + length] into a message tuple, whose first item is
+	the message type and the rest are its fields."""
+
+	if kind == PLAYED or kind == REJECTED:
+		if length != PLAYED_PAYLOAD.size:
+			raise ProtocolError(f"Move payload of {length} bytes")
+		return (kind, PLAYED_PAYLOAD.unpack_from(buffer, offset)[0])
+
+	elif kind == CREATE:
+		if length < CREATE_PAYLOAD.size:
+			raise ProtocolError(f"CREATE payload of {length} bytes")
+		order, size, win_length = CREATE_PAYLOAD.unpack_from(buffer, offset)
+		if order >= len(ORDERS):
+			raise ProtocolError(f"Unknown order {order}")
+		rival_name = bytes(buffer[offset + CREATE_PAYLOAD.size:offset + length]).decode("utf-8")
+		return (CREATE, rival_name, ORDERS[order], size, win_length)
+
+	elif kind == HELLO:
+		if length < HELLO_PAYLOAD.size:
+			raise ProtocolError(f"HELLO payload of {length} bytes")
+		capabilities, size, win_length, rating = HELLO_PAYLOAD.unpack_from(buffer, offset)
+		name = bytes(buffer[offset + HELLO_PAYLOAD.size:offset + length]).decode("utf-8")
+		return (HELLO, name, capabilities, size, win_length, rating or None)
+
+	elif kind == WATCH:
+		if length != WATCH_PAYLOAD.size:
+			raise ProtocolError(f"WATCH payload of {length} bytes")
+		return (WATCH, WATCH_PAYLOAD.unpack_from(buffer, offset)[0])
+
+	elif kind == WATCHING:
+		if length < WATCHING_PAYLOAD.size:
+			raise ProtocolError(f"WATCHING payload of {length} bytes")
+		size, win_length, x_length, o_length, x_count, o_count = WATCHING_PAYLOAD.unpack_from(buffer, offset)
+		if length != WATCHING_PAYLOAD.size + x_length + o_length + 2 * (x_count + o_count):
+			raise ProtocolError(f"WATCHING payload of {length} bytes")
+		start = offset + WATCHING_PAYLOAD.size
+		x_name = bytes(buffer[start:start + x_length]).decode("utf-8")
+		o_name = bytes(buffer[start + x_length:start + x_length + o_length]).decode("utf-8")
+		cells = struct.unpack_from(f"!{x_count + o_count}H", buffer, start + x_length + o_length)
+		return (WATCHING, x_name, o_name, size, win_length, cells[:x_count], cells[x_count:])
+
+	elif kind == SESSION or kind == RESUME:
+		payload = SESSION_PAYLOAD if kind == SESSION else RESUME_PAYLOAD
+		if length <= payload.size:
+			raise ProtocolError(f"{NAMES[kind]} payload of {length} bytes")
+		token = bytes(buffer[offset + payload.size:offset + length])
+		return (kind, token, *payload.unpack_from(buffer, offset))
+
+	elif kind == RESUMED:
+		if length < RESUMED_PAYLOAD.size:
+			raise ProtocolError(f"RESUMED payload of {length} bytes")
+		game, order, size, win_length, first, count = RESUMED_PAYLOAD.unpack_from(buffer, offset)
+		if order >= len(ORDERS) or length < RESUMED_PAYLOAD.size + 2 * count:
+			raise ProtocolError(f"RESUMED payload of {length} bytes")
+		moves = struct.unpack_from(f"!{count}H", buffer, offset + RESUMED_PAYLOAD.size)
+		rival_name = bytes(buffer[offset + RESUMED_PAYLOAD.size + 2 * count:offset + length]).decode("utf-8")
+		return (RESUMED, game, rival_name, ORDERS[order], size, win_length, first, moves)
+
+	elif kind in (RESTART, CLOSING, PING, PONG, LEAVE):
+		return (kind,)
+
+	raise ProtocolError(f"Unknown message type {kind}")
+
+
+
+def decode_frame(frame):
+	"""Decodes a message from a single complete frame, such as one forwarded between servers."""
+
+	if len(frame) < HEADER.size:
+		raise ProtocolError(f"Frame of {len(frame)} bytes")
+
+	version, kind, _, length = HEADER.unpack_from(frame)
+
+	if version != VERSION:
+		raise ProtocolError(f"Unsupported protocol version {version}")
+	if len(frame) != HEADER.size + length:
+		raise ProtocolError(f"Frame of {len(frame)} bytes with a payload of {length}")
+
+	return decode(kind, frame, HEADER.size, length)
+
+
+
+class FrameDecoder():
+
+
+	def __init__(self, size=4096):
+		"""Keeps a single buffer that incoming bytes are received into and frames are decoded from. The
+		buffer is reused for the whole connection and only grows if a frame doesn't fit in it."""
+
+		self.buffer = bytearray(size)
+		self.start = 0 #First byte not decoded yet
+		self.end = 0 #First free byte
+		self.channel = 0 #Channel of the message last yielded by messages()
+
+
+	def get_buffer(self, sizehint=-1):
+		"""Returns a writable view over the free part of the buffer. Meant for socket.recv_into and
+		asyncio.BufferedProtocol.get_buffer."""
+
+		if self.start == self.end:
+			self.start = self.end = 0
+
+		elif self.end == len(self.buffer): #Moves the incomplete frame to the front to make room
+			pending = self.end - self.start
+			self.buffer[:pending] = self.buffer[self.start:self.end]
+			self.start, self.end = 0, pending
+
+		return memoryview(self.buffer)[self.end:]
+
+
+	def buffer_updated(self, nbytes):
+		"""Called after nbytes were written into the view returned by get_buffer."""
+
+		self.end += nbytes
+
+
+	def feed(self, data):
+		"""Copies data into the buffer. For callers that receive bytes instead of filling the buffer."""
+
+		while data:
+			view = self.get_buffer()
+			n = min(len(view), len(data))
+			view[:n] = data[:n]
+			view.release()
+			self.buffer_updated(n)
+			data = data[n:]
+
+			if data and self.end == len(self.buffer) and self.start == 0:
+				self.grow(len(self.buffer) * 2)
+
+
+	def grow(self, size):
+		"""Replaces the buffer with a bigger one, keeping the bytes that weren't decoded yet."""
+
+		pending = self.end - self.start
+		buffer = bytearray(max(size, pending))
+		buffer[:pending] = self.buffer[self.start:self.end]
+		self.buffer = buffer
+		self.start, self.end = 0, pending
+
+
+	def messages(self):
+		"""Yields every complete message in the buffer. Incomplete frames are left for the next read. The
+		channel of each message is in self.channel while it is being handled."""
+
+		while self.end - self.start >= HEADER.size:
+
+			version, kind, self.channel, length = HEADER.unpack_from(self.buffer, self.start)
+
+			if version != VERSION:
+				raise ProtocolError(f"Unsupported protocol version {version}")
+
+			frame_end = self.start + HEADER.size + length
+
+			if frame_end > self.end:
+				if HEADER.size + length > len(self.buffer): #Frame is bigger than the whole buffer
+					self.grow(HEADER.size + length)
+				break
+
+			offset = self.start + HEADER.size
+			self.start = frame_end
+
+			yield decode(kind, self.buffer, offset, length)
\ No newline at end of file
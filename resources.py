@@ -0,0 +1,30 @@
+"""Files the app ships with, in res/ next to the code. Paths are resolved from this file rather than the working
+directory, so the app starts from anywhere. Images are read from disk the first time they are asked for and then
+shared by every screen for the rest of the process."""
+
+import os
+import tkinter as tk
+
+
+
+RES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "res")
+
+IMAGES = {} #File name to its tk.PhotoImage, once loaded
+
+
+
+def path(name):
+	"""Full path of a file in res/."""
+
+	return os.path.join(RES_DIR, name)
+
+
+def image(name):
+	"""Returns the image in res/name, loading it on first use. Needs the Tk root to exist."""
+
+	loaded = IMAGES.get(name)
+
+	if loaded is None:
+		loaded = IMAGES[name] = tk.PhotoImage(file=path(name))
+
+	return loaded
@@ -24,7 +24,12 @@ class InitialScreen(tk.Frame):
 		#This button indicates that the player will join an existing game
 		self.join_button = tk.Button(self, text="Join game", command=lambda: self.master.pack_info_gathering_screen('join'))
 		self.join_button.configure(bg=BACKGROUND_BUTTON, fg=FOREGROUND_BUTTON)
-		self.join_button.pack(pady=(5,20))
+		self.join_button.pack(pady=(5,5))
+
+		#This button indicates that the player will create a game and play it against the computer
+		self.computer_button = tk.Button(self, text="Play computer", command=lambda: self.master.pack_info_gathering_screen('computer'))
+		self.computer_button.configure(bg=BACKGROUND_BUTTON, fg=FOREGROUND_BUTTON)
+		self.computer_button.pack(pady=(5,20))
 
 
 
@@ -41,7 +46,7 @@ class InfoGatheringScreen(tk.Frame):
 		self.mode = mode
 		self.configure(bg=BACKGROUND_SCREEN)
 
-		if mode == 'create': #Player chose to create a game
+		if mode in ('create', 'computer'): #Player chose to create a game, either for a friend or the computer
 
 			ip_address_prompt = "Input your device ip address"
 			port_prompt = "Input the port to listen"
@@ -93,7 +98,7 @@ class InfoGatheringScreen(tk.Frame):
 
 		if len(name) > 0 and len(ip_address) > 0 and len(port) > 0:
 			if port.isdigit() and 50000 < int(port) < 60000:
-				command = self.master.create_game if self.mode == 'create' else self.master.join_game
+				command = self.master.create_game if self.mode in ('create', 'computer') else self.master.join_game
 				command(name, ip_address, int(port), self.mode)
 			else:
 				msgbox.showerror("Error", "Port must be an integer between 50000 and 60000.")
@@ -1,4 +1,6 @@
 BACKGROUND_BUTTON = "#21243D"
 BACKGROUND_SCREEN = "#1B262C"
 FOREGROUND_BUTTON = "#FFD3B6"
-FOREGROUND_LABEL = "#FFA372"
\ No newline at end of file
+FOREGROUND_LABEL = "#FFA372"
+BACKGROUND_CELL = "#32414A" #Cells that can't be played
+BACKGROUND_CELL_ACTIVE = "#E8E8E8" #Cells the player may click
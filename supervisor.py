@@ -0,0 +1,456 @@
+"""Runs a server across several processes, so that games aren't limited to the one core the GIL allows. The
+supervisor accepts every player, reads its HELLO and pairs it in the lobby like a plain Server. Each pair is then
+handed to one of the worker processes, file descriptors and all, and the whole room lives on that worker until it
+closes. Players that leave their room and say HELLO again are handed back to the supervisor to be paired anew,
+and players that reconnect to resume their seat are handed to the worker that holds it. Players can't tell, since
+their connection stays the same. Workers report their load to the supervisor, which adds it up in health(), and
+workers that die are replaced. Games can't be played on channels other than 0, since a socket can only be on one
+worker. Unix only, since sockets are passed with SCM_RIGHTS:
+
+	python dedicated_server.py --workers 4"""
+
+import asyncio
+import json
+import multiprocessing
+import signal
+import socket
+import time
+
+from networking import Server, PlayerConnection, DROP, session_room
+from connection import CLOSED
+from gamelog import GameLogWriter, FSYNC_INTERVAL
+import metrics
+
+
+
+CONTROL_BUFFER = 65536 #Control messages are small JSON documents, one per packet
+
+
+
+def send_control(control, message, fds=()):
+	"""Sends a control message, and the given file descriptors with it, over a SOCK_SEQPACKET socket."""
+
+	data = json.dumps(message).encode("utf-8")
+
+	if fds:
+		socket.send_fds(control, [data], fds)
+	else:
+		control.send(data)
+
+
+def receive_control(control, max_fds=0):
+	"""Returns (message, file descriptors), or (None, []) once the other end is closed."""
+
+	data, fds, _, _ = socket.recv_fds(control, CONTROL_BUFFER, max_fds)
+
+	if not data:
+		return None, fds
+
+	return json.loads(data), fds
+
+
+def describe(connection):
+	"""Details of a player that go along with its socket when it is handed to another process, including the
+	bytes read from it but not handled yet. Reading is paused, since whatever comes next is read over there."""
+
+	connection.transport.pause_reading()
+	decoder = connection.decoder
+	details = {
+		"name": connection.name,
+		"capabilities": connection.capabilities,
+		"variant": connection.variant,
+		"rating": connection.rating,
+		"pending": bytes(decoder.buffer[decoder.start:decoder.end]).hex()
+	}
+	decoder.start = decoder.end #Handled by the other process, so it mustn't be handled here too
+
+	return details
+
+
+def hand_off(control, message, connections):
+	"""Sends the message over the control socket along with the connections, which are then closed here
+	without shutting them down, so the other process's copies keep them open. Returns False if they
+	couldn't be sent, in which case they are closed for good."""
+
+	message["players"] = [describe(connection) for connection in connections]
+
+	try:
+		send_control(control, message, [connection.transport.get_extra_info("socket").fileno() for connection in connections])
+	except OSError as e:
+		print(f"Couldn't hand over {message['type']} {message.get('room', '')}. {e}")
+		sent = False
+	else:
+		sent = True
+
+	for connection in connections:
+		connection.close()
+
+	return sent
+
+
+async def take_over(server, fd, details):
+	"""Returns a PlayerConnection of the server for a socket handed over by another process, with the given
+	details of its player."""
+
+	sock = socket.socket(fileno=fd)
+	sock.setblocking(False)
+	_, connection = await asyncio.get_running_loop().connect_accepted_socket(lambda: PlayerConnection(server), sock)
+
+	connection.name = details["name"]
+	connection.capabilities = details["capabilities"]
+	connection.variant = tuple(details["variant"]) if details["variant"] is not None else None
+	connection.rating = details["rating"]
+
+	return connection
+
+
+def catch_up(connection, details):
+	"""Handles the bytes the other process had read from the connection but not acted on."""
+
+	if details["pending"]:
+		connection.decoder.feed(bytes.fromhex(details["pending"]))
+		connection.buffer_updated(0)
+
+
+
+class WorkerServer(Server):
+
+	multiplexing = False #Sockets are handed between processes whole, so they can't hold games of different rooms
+
+	def __init__(self, control, heartbeat_interval=10, idle_timeout=30, status_interval=1, game_log=None, spectator_policy=DROP,
+		resume_timeout=30):
+		"""Server with no listening socket of its own. Pairs of players are received from the supervisor over
+		the control socket, and the room they play in is opened here. The number of rooms and connections is
+		sent back every status_interval seconds."""
+
+		super().__init__(None, None, heartbeat_interval=heartbeat_interval, idle_timeout=idle_timeout, game_log=game_log,
+			spectator_policy=spectator_policy, resume_timeout=resume_timeout)
+		self.control = control
+		self.status_interval = status_interval
+
+
+	async def serve(self):
+
+		loop = asyncio.get_running_loop()
+		loop.add_reader(self.control.fileno(), self.read_control)
+		status = loop.create_task(self.send_status())
+
+		try:
+			await super().serve()
+		finally:
+			status.cancel()
+			loop.remove_reader(self.control.fileno())
+
+
+	def read_control(self):
+
+		try:
+			message, fds = receive_control(self.control, 2)
+		except OSError:
+			message, fds = None, []
+
+		if message is None: #Supervisor is gone, and no more players will come
+			self.close()
+			return
+
+		if message["type"] == "room":
+			asyncio.get_running_loop().create_task(self.adopt(message, fds))
+
+		elif message["type"] == "watch":
+			asyncio.get_running_loop().create_task(self.adopt_spectator(message, fds[0]))
+
+		elif message["type"] == "resume":
+			asyncio.get_running_loop().create_task(self.adopt_resumed(message, fds[0]))
+
+
+	async def adopt(self, message, fds):
+		"""Takes over the connections of a pair of players and opens their room."""
+
+		players = [await take_over(self, fd, details) for fd, details in zip(fds, message["players"])]
+
+		if any(player.state == CLOSED for player in players): #Someone left while being handed over
+			for player in players:
+				player.close()
+			self.send({"type": "closed", "room": message["room"]})
+			return
+
+		self.open_room(tuple(message["variant"]), players, message["room"])
+
+		for player, details in zip(players, message["players"]):
+			catch_up(player, details)
+
+
+	async def adopt_spectator(self, message, fd):
+		"""Takes over the connection of a spectator of one of this worker's rooms."""
+
+		spectator = await take_over(self, fd, message["players"][0])
+
+		if spectator.state != CLOSED:
+			self.watch(spectator, message["room"])
+			catch_up(spectator, message["players"][0])
+
+
+	async def adopt_resumed(self, message, fd):
+		"""Takes over the connection of a player reconnecting to its seat in one of this worker's rooms."""
+
+		player = await take_over(self, fd, message["players"][0])
+
+		if player.state != CLOSED:
+			self.resume(player, bytes.fromhex(message["token"]), message["game"], message["seen"])
+			catch_up(player, message["players"][0])
+
+
+	def seat_player(self, player):
+		"""A player that left its room and said HELLO again goes back to the supervisor, whose lobby pairs it."""
+
+		hand_off(self.control, {"type": "requeue"}, [player])
+
+
+	def close_room(self, room):
+
+		super().close_room(room)
+		self.send({"type": "closed", "room": room.room_id})
+
+
+	async def send_status(self):
+
+		while True:
+			self.send({"type": "status", **self.health(), "metrics": metrics.REGISTRY.snapshot()})
+			await asyncio.sleep(self.status_interval)
+
+
+	def send(self, message):
+
+		try:
+			send_control(self.control, message)
+		except OSError: #Supervisor is gone. The control socket will report it too
+			pass
+
+
+
+def run_worker(control, settings):
+	"""Entry point of a worker process. Settings is a dict from Supervisor.worker_settings. Ctrl-C and SIGTERM
+	sent to the whole process group are left to the supervisor, which stops workers by closing their control
+	socket. Each worker keeps its own game log."""
+
+	signal.signal(signal.SIGINT, signal.SIG_IGN)
+	signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+	game_log = GameLogWriter(settings["game_log_path"], fsync=settings["fsync"]) if settings["game_log_path"] else None
+
+	try:
+		WorkerServer(control, settings["heartbeat_interval"], settings["idle_timeout"], game_log=game_log,
+			spectator_policy=settings["spectator_policy"], resume_timeout=settings["resume_timeout"]).accept_players()
+	finally:
+		if game_log is not None:
+			game_log.close()
+
+
+
+class WorkerProcess():
+
+
+	def __init__(self, index, context, settings):
+		"""Starts a worker process with the given settings, connected to the supervisor by a control socket.
+		If there is a game log path in the settings, the worker logs its games to that path followed by its
+		index."""
+
+		self.index = index
+		self.control, child = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+		settings = dict(settings, game_log_path=f"{settings['game_log_path']}.{index}" if settings["game_log_path"] else None)
+		self.process = context.Process(target=run_worker, args=(child, settings), daemon=True)
+		self.process.start()
+		child.close()
+		self.rooms = set() #Ids of the rooms pinned to this worker
+		self.status = {}
+		self.updated = time.monotonic()
+		self.alive = True
+
+
+	def health(self):
+
+		return {
+			"worker": self.index,
+			"pid": self.process.pid,
+			"alive": self.alive,
+			"rooms": len(self.rooms),
+			"connections": self.status.get("connections", 0),
+			"reaped": self.status.get("reaped", 0),
+			"updated": round(time.monotonic() - self.updated, 3)
+		}
+
+
+	def stop(self, timeout=5):
+		"""Closing the control socket tells the worker to close its connections and exit."""
+
+		self.alive = False
+		self.control.close()
+		self.process.join(timeout)
+
+		if self.process.is_alive():
+			self.process.kill()
+			self.process.join()
+
+
+
+class Supervisor(Server):
+
+	multiplexing = False
+
+	def __init__(self, ip_address, port, workers=2, max_rooms=None, heartbeat_interval=10, idle_timeout=30, size=3, win_length=3, variants=(),
+		game_log_path=None, fsync=FSYNC_INTERVAL, spectator_policy=DROP, resume_timeout=30):
+		"""Server that accepts and pairs players, and hands every pair to one of its worker processes. New rooms
+		go to the worker with the fewest rooms. Worker i logs its games to game_log_path.i, if a path is given,
+		with the given fsync policy. The other arguments are the same as Server's."""
+
+		super().__init__(ip_address, port, max_rooms, heartbeat_interval, idle_timeout, size, win_length, variants,
+			spectator_policy=spectator_policy)
+		self.worker_settings = {
+			"heartbeat_interval": heartbeat_interval,
+			"idle_timeout": idle_timeout,
+			"game_log_path": game_log_path,
+			"fsync": fsync,
+			"spectator_policy": spectator_policy,
+			"resume_timeout": resume_timeout
+		}
+		self.worker_count = workers
+		self.workers = []
+		self.context = multiprocessing.get_context("spawn") #Workers don't inherit the listening socket or the event loop
+
+
+	async def serve(self):
+
+		self.loop = asyncio.get_running_loop()
+
+		for index in range(self.worker_count):
+			self.workers.append(self.start_worker(index))
+
+		try:
+			await super().serve()
+		finally:
+			for worker in self.workers:
+				if worker.alive:
+					self.loop.remove_reader(worker.control.fileno())
+					worker.stop()
+
+
+	def start_worker(self, index):
+
+		worker = WorkerProcess(index, self.context, self.worker_settings)
+		self.loop.add_reader(worker.control.fileno(), self.read_control, worker)
+		print(f"Started worker {index} with pid {worker.process.pid}")
+
+		return worker
+
+
+	def read_control(self, worker):
+
+		try:
+			message, fds = receive_control(worker.control, 1)
+		except OSError:
+			message, fds = None, []
+
+		if message is None:
+			self.worker_died(worker)
+			return
+
+		if message["type"] == "status":
+			worker.status = message
+			worker.updated = time.monotonic()
+
+		elif message["type"] == "closed":
+			worker.rooms.discard(message["room"])
+			self.rooms.pop(message["room"], None)
+
+		elif message["type"] == "requeue":
+			self.loop.create_task(self.requeue(message, fds[0]))
+
+
+	async def requeue(self, message, fd):
+		"""Takes back a player that left its room on a worker to play again, and pairs it anew."""
+
+		details = message["players"][0]
+		player = await take_over(self, fd, details)
+
+		if player.state != CLOSED:
+			self.seat_player(player)
+			catch_up(player, details)
+
+
+	def worker_died(self, worker):
+		"""The rooms of a dead worker are gone, along with their connections. A new worker takes its place."""
+
+		self.loop.remove_reader(worker.control.fileno())
+		worker.stop()
+		print(f"Worker {worker.index} exited with code {worker.process.exitcode}")
+
+		for room_id in worker.rooms:
+			self.rooms.pop(room_id, None)
+
+		if not self.stopped.is_set():
+			self.workers[worker.index] = self.start_worker(worker.index)
+
+
+	def open_room(self, variant, players, room_id=None):
+		"""Hands both players to the least busy worker, which opens their room."""
+
+		workers = [worker for worker in self.workers if worker.alive]
+		room_id = next(self.room_ids) if room_id is None else room_id
+
+		if not workers:
+			print("No worker is running. The players were turned away.")
+			for player in players:
+				player.close()
+			return
+
+		worker = min(workers, key=lambda worker: len(worker.rooms))
+		message = {"type": "room", "room": room_id, "variant": variant}
+
+		if hand_off(worker.control, message, players):
+			worker.rooms.add(room_id)
+			self.rooms[room_id] = worker
+
+
+	def watch(self, spectator, room_id):
+		"""Hands the spectator to the worker hosting the room."""
+
+		worker = self.rooms.get(room_id)
+
+		if worker is None:
+			print(f"Spectator {spectator.peer} asked for room {room_id}, which isn't open.")
+			spectator.close()
+			return
+
+		hand_off(worker.control, {"type": "watch", "room": room_id}, [spectator])
+
+
+	def resume(self, connection, token, game, seen):
+		"""Hands the reconnecting player to the worker hosting the room its token is for, which holds its seat."""
+
+		room_id = session_room(token)
+		worker = self.rooms.get(room_id)
+
+		if worker is None: #Room is gone, which the server tells the player
+			super().resume(connection, token, game, seen)
+			return
+
+		message = {"type": "resume", "room": room_id, "token": token.hex(), "game": game, "seen": seen}
+		hand_off(worker.control, message, [connection])
+
+
+	def health(self):
+		"""Adds up the load of the supervisor and every worker."""
+
+		workers = [worker.health() for worker in self.workers]
+		health = super().health()
+		health["connections"] += sum(worker["connections"] for worker in workers)
+		health["reaped"] += sum(worker["reaped"] for worker in workers)
+		health["workers"] = workers
+
+		return health
+
+
+	def metrics(self):
+		"""Adds the metrics last reported by every worker to the supervisor's own."""
+
+		return metrics.REGISTRY.render(worker.status["metrics"] for worker in self.workers if "metrics" in worker.status)
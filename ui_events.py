@@ -0,0 +1,97 @@
+import sys
+from collections import deque
+
+
+
+class EventQueue():
+
+
+	def __init__(self, widget, interval=16, batch_size=100):
+		"""Hands work from other threads to the Tk main loop, where every widget has to be touched. Threads
+		post events, which the main loop drains every interval milliseconds (about once per frame), at most
+		batch_size at a time so a burst of messages can't freeze the window. Redraws requested while a batch
+		runs are coalesced: only the last one for each key is done, once the batch is over. An event that raises
+		is reported like a failing Tk callback, and the rest are still handled."""
+
+		self.widget = widget
+		self.interval = interval
+		self.batch_size = batch_size
+		self.events = deque() #Appending and popping are thread safe
+		self.redraws = {} #Key to the redraw to do after the batch
+		self.draining = False
+		self.running = False
+		self.after_id = None
+
+
+	def start(self):
+		"""Starts draining. Must be called from the Tk thread."""
+
+		self.running = True
+
+		if self.after_id is None:
+			self.after_id = self.widget.after(self.interval, self.drain)
+
+
+	def stop(self):
+		"""Stops draining and forgets the events that were not handled yet. Must be called from the Tk thread,
+		even from an event callback."""
+
+		self.running = False
+
+		if self.after_id is not None:
+			self.widget.after_cancel(self.after_id)
+			self.after_id = None
+
+		self.events.clear()
+		self.redraws.clear()
+
+
+	def post(self, callback, *args):
+		"""Has callback(*args) called on the Tk thread. Can be called from any thread."""
+
+		self.events.append((callback, args))
+
+
+	def redraw(self, key, callback, *args):
+		"""Has callback(*args) called once the current batch is handled, unless another redraw with the same key
+		replaces it first. Called from event callbacks, on the Tk thread."""
+
+		self.redraws.pop(key, None) #Latest one goes last, so redraws keep the order they were last asked in
+		self.redraws[key] = (callback, args)
+
+
+	def drain(self):
+
+		self.after_id = None
+
+		if self.draining: #A dialog opened by an event runs a nested main loop, which lands here again
+			self.after_id = self.widget.after(self.interval, self.drain)
+			return
+
+		self.draining = True
+
+		try:
+			for _ in range(self.batch_size):
+				if not self.events or not self.running:
+					break
+				callback, args = self.events.popleft()
+				self.run(callback, args)
+
+			while self.redraws and self.running:
+				key = next(iter(self.redraws))
+				callback, args = self.redraws.pop(key)
+				self.run(callback, args)
+		finally:
+			self.draining = False
+
+		#Whatever is left of a burst goes on right after Tk had a chance to handle input and paint
+		if self.running and self.after_id is None:
+			self.after_id = self.widget.after(1 if self.events else self.interval, self.drain)
+
+
+	def run(self, callback, args):
+
+		try:
+			callback(*args)
+		except Exception:
+			self.widget.nametowidget(".").report_callback_exception(*sys.exc_info())